@@ -4,7 +4,7 @@
 from flask import (
     Flask,
     render_template,
-    send_file,
+    Response,
     request,
     url_for,
     request,
@@ -27,7 +27,9 @@ from werkzeug.utils import secure_filename
 
 # Other modules
 from dotenv import load_dotenv
+import click
 from urllib.parse import urlparse, urljoin
+from bson.errors import InvalidId
 import uuid
 import os
 
@@ -35,12 +37,36 @@ import os
 from user import User, Anonymous
 from event import Event
 from face import Face
-from utils import remove_files_from_folder, download_create_zip
-from deepface_function import extract_faces_and_compare, update_faces_collection
+from photo import Photo
+from user_events import get_user_events, invalidate_user_events
+from occurrence import Occurrence
+from thumbnails import (
+    CONTENT_TYPE,
+    stored_crop_path,
+    thumbnail_from_bytes,
+    thumbnail_path,
+)
+from utils import stream_zip, paginate
+from embedding_store import reset_matcher
+from recluster import recluster_event
+import storage_cache
+import upload_queue
+from indexes import ensure_indexes, check_query_plans
+from ingest_queue import (
+    init_queue,
+    spool_file,
+    find_job,
+    resume_job,
+    enqueue_job,
+    cancel_event_jobs,
+    batch_status,
+)
+from ingest_worker import ensure_workers, run_ingest
 from supabase_function import (
     upload_image_file,
-    image_urls,
+    storage,
     get_url,
+    get_urls,
     delete_folder,
     delete_file,
 )
@@ -90,6 +116,25 @@ talisman = Talisman(app, content_security_policy=csp)
 csrf = CSRFProtect()
 csrf.init_app(app)
 
+# Create ingest job queue
+init_queue()
+
+# Create indexes
+ensure_indexes(mongo.db)
+
+
+def serving():
+    # True in the web server and `flask run`, False in other flask commands
+    ctx = click.get_current_context(silent=True)
+    return ctx is None or ctx.info_name == "run"
+
+
+# Send uploads a previous run left in the spool, and process queued photos
+# unless ingestion runs in `flask ingest-worker`
+if serving():
+    storage.start_uploader()
+    ensure_workers()
+
 # Create login manager
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -101,39 +146,24 @@ login_manager.login_view = "login"
 @app.context_processor
 def utility_processor():
     def get_events():
-        user_events = mongo.db.users.aggregate(
+        # Cached per user, only the preview face URLs are built per render
+        user_events = get_user_events(mongo.db, current_user.id)
+        events = [{**event, "faces": list(event["faces"])} for event in user_events]
+        all_faces = [face for event in events for face in event["faces"]]
+        face_urls = get_urls(
             [
-                {"$match": {"id": current_user.id}},
-                {
-                    "$lookup": {
-                        "from": "events",
-                        "localField": "events",
-                        "foreignField": "_id",
-                        "as": "eventDetails",
-                    }
-                },
-                {"$unwind": "$eventDetails"},
-                {
-                    "$lookup": {
-                        "from": "faces",
-                        "localField": "eventDetails.faces",
-                        "foreignField": "_id",
-                        "as": "eventDetails.faces",
-                    }
-                },
-                {"$group": {"_id": "$_id", "eventDetails": {"$push": "$eventDetails"}}},
-                {"$project": {"_id": 0}},
+                stored_crop_path(
+                    "{}/{}/faces".format(current_user.id, face["event_id"]), face
+                )
+                for face in all_faces
             ]
         )
-        all_event = list(user_events)
-        user_events_details = all_event[0]["eventDetails"] if len(all_event) else []
-        for event in user_events_details:
-            event_id = event['id']
-            for face in event['faces']:
-                face_id = face['id']
-                face['image_path'] = get_url("{}/{}/faces/{}.png"
-                .format(current_user.id, event_id, face_id))
-        return user_events_details
+        face_urls = iter(face_urls)
+        for event in events:
+            event["faces"] = [
+                {**face, "image_path": next(face_urls)} for face in event["faces"]
+            ]
+        return events
 
     def get_user():
         user = mongo.db.users.find_one({"id": current_user.id}, {"_id": 0})
@@ -144,6 +174,115 @@ def utility_processor():
     return dict(get_events=get_events, get_user=get_user)
 
 
+# PAGE HELPERS
+# Each returns one page of items and the cursor of the next page, so the
+# work per request is bounded by the page size
+
+
+def photo_urls(photos):
+    # Thumbnail and original URL of each photo, in one batch. Photos uploaded
+    # before thumbnails existed show the original in the gallery too.
+    urls = get_urls(
+        [photo["path"] for photo in photos]
+        + [photo.get("thumb_path") or photo["path"] for photo in photos]
+    )
+    return list(zip(urls[len(photos) :], urls[: len(photos)]))
+
+
+def event_images_page(event_id, cursor=None):
+    # Read the photo manifest instead of listing storage
+    photos, next_cursor = paginate(
+        mongo.db.images,
+        {"event_id": event_id},
+        cursor,
+        projection={"id": 1, "path": 1, "thumb_path": 1},
+    )
+    items = [
+        {"id": photo["id"], "image_path": thumb_url, "full_path": full_url}
+        for photo, (thumb_url, full_url) in zip(photos, photo_urls(photos))
+    ]
+    return items, next_cursor
+
+
+def event_faces_page(event_id, cursor=None):
+    face_docs, next_cursor = paginate(
+        mongo.db.faces,
+        {"event_id": event_id},
+        cursor,
+        projection={"id": 1, "name": 1, "crop_path": 1},
+    )
+    folder_path = "{}/{}/faces".format(current_user.id, event_id)
+    urls = get_urls([stored_crop_path(folder_path, face) for face in face_docs])
+    items = [
+        {"id": face["id"], "name": face["name"], "image_path": url}
+        for face, url in zip(face_docs, urls)
+    ]
+    return items, next_cursor
+
+
+def face_images_page(face, cursor=None):
+    # Photos of a face and every other face in them, from the occurrences
+    # collection in a fixed number of indexed queries per page
+    occurrences = mongo.db.occurrences
+    own, next_cursor = paginate(
+        occurrences, {"face_id": face.id}, cursor, projection={"img_id": 1, "face_location": 1}
+    )
+    img_ids = [occurrence["img_id"] for occurrence in own]
+
+    others = list(
+        occurrences.find(
+            {"img_id": {"$in": img_ids}, "face_id": {"$ne": face.id}},
+            {"face_id": 1, "img_id": 1, "face_location": 1},
+        )
+    )
+    names = {
+        other_face["id"]: other_face["name"]
+        for other_face in mongo.db.faces.find(
+            {"id": {"$in": list({other["face_id"] for other in others})}},
+            {"id": 1, "name": 1},
+        )
+    }
+    other_faces = {}
+    for other in others:
+        other_faces.setdefault(other["img_id"], []).append(
+            {
+                "id": other["face_id"],
+                "name": names.get(other["face_id"], "unknown"),
+                "face_location": other["face_location"],
+            }
+        )
+
+    # Thumbnails from the photo manifest, original paths for older photos
+    photos = {
+        photo["id"]: photo
+        for photo in mongo.db.images.find(
+            {"event_id": face.event_id, "id": {"$in": img_ids}},
+            {"id": 1, "path": 1, "thumb_path": 1},
+        )
+    }
+    urls = photo_urls(
+        [
+            photos.get(img_id)
+            or {"path": "{}/{}/{}".format(current_user.id, face.event_id, img_id)}
+            for img_id in img_ids
+        ]
+    )
+    items = [
+        {
+            "image_path": thumb_url,
+            "full_path": full_url,
+            "face": {
+                "id": face.id,
+                "name": face.name,
+                "face_location": occurrence["face_location"],
+            },
+            "other_faces": other_faces.get(occurrence["img_id"], []),
+        }
+        for occurrence, (thumb_url, full_url) in zip(own, urls)
+    ]
+    return items, next_cursor
+
+
 # ROUTES
 
 
@@ -256,14 +395,12 @@ def add_event():
         eend_date = request.form["eend_date"].strip()
         edesc = request.form["edesc"].strip()
         events = mongo.db.events
-        new_event = Event(etitle, elocation, estart_date, eend_date, edesc)
-        event_to_save = new_event.dict()
-        inserted_event = events.insert_one(event_to_save)
-
-        users = mongo.db.users
-        users.update_one(
-            {"id": current_user.id}, {"$push": {"events": inserted_event.inserted_id}}
+        new_event = Event(
+            etitle, elocation, estart_date, eend_date, edesc, user_id=current_user.id
         )
+        event_to_save = new_event.dict()
+        events.insert_one(event_to_save)
+        invalidate_user_events(mongo.db, current_user.id)
 
         return render_template("event_add.html", msg="Event Created Successfully.")
 
@@ -272,20 +409,20 @@ def add_event():
 @login_required
 def delete_event(event_id):
     try:
+        # Photos still waiting to be processed are dropped first
+        cancel_event_jobs(current_user.id, event_id)
+
         events = mongo.db.events
-        deleted_event = events.find_one_and_delete({"id": event_id})
-        users = mongo.db.users
-        users.update_one(
-            {"id": current_user.id}, {"$pull": {"events": deleted_event["_id"]}}
-        )
+        events.delete_one({"id": event_id})
+        invalidate_user_events(mongo.db, current_user.id)
 
         event_path = f"{str(current_user.id)}/{str(event_id)}"
         delete_folder(event_path)
 
-        faces = mongo.db.faces
-        face_ids = deleted_event["faces"]
-        for face_id in face_ids:
-            faces.find_one_and_delete({"_id": face_id})
+        mongo.db.faces.delete_many({"event_id": event_id})
+        mongo.db.images.delete_many({"event_id": event_id})
+        mongo.db.occurrences.delete_many({"event_id": event_id})
+        reset_matcher(event_id)
 
         return redirect(url_for("events"))
 
@@ -307,12 +444,15 @@ def view_event(event_id):
     event = events.find_one({"id": event_id})
     if event:
         event = Event.make_from_dict(event)
-        gallery_path = f"{str(current_user.id)}/{str(event_id)}"
 
-        image_files = image_urls(gallery_path)
+        # First page only, the rest is loaded from the JSON endpoint on scroll
+        image_files, next_cursor = event_images_page(event_id)
 
         return render_template(
-            "event_details.html", event=event, image_files=image_files
+            "event_details.html",
+            event=event,
+            image_files=image_files,
+            next_cursor=next_cursor,
         )
 
     return redirect(url_for("dashboard"))
@@ -327,12 +467,17 @@ def event_upload(event_id):
         event = Event.make_from_dict(event)
 
         if request.method == "POST":
-            event_path = f"{str(current_user.id)}/{str(event_id)}"
-
-            facelib_path = f"{str(current_user.id)}/{str(event_id)}/faces"
-
             files = request.files.getlist("files")
 
+            # Files are spooled and queued, ingest workers process them.
+            # The loop starts with the app, this restarts it if it died.
+            ensure_workers()
+            batch_id = uuid.uuid4().hex
+
+            # Photos are identified by content, so uploading the same files
+            # again only queues the new ones and resumes unfinished ones. Each
+            # file is spooled and hashed as it is read.
+            uploads = []
             for file in files:
                 if file.filename == "":
                     continue
@@ -340,21 +485,57 @@ def event_upload(event_id):
                 if file and allowed_file(file.filename):
                     file_ext = file.filename.rsplit(".", 1)[1].lower()
                     file_id = str(uuid.uuid4())
-                    img_bytes = file.read()
                     # filename = secure_filename(file.filename)
                     img_id = file_id + "." + file_ext
-                    img_path = f"{event_path}/{img_id}"
-                    results = extract_faces_and_compare(img_bytes, img_id, facelib_path)
-                    update_faces_collection(mongo, results, event_id)
-                    upload_image_file(img_path, img_bytes, file_ext)
+                    file_path, img_hash = spool_file(
+                        current_user.id, event_id, img_id, file.stream
+                    )
+                    uploads.append((img_id, file_ext, file_path, img_hash))
 
                 else:
+                    # Nothing of the upload is queued
+                    for upload in uploads:
+                        os.remove(upload[2])
                     return render_template(
-                        "event_upload.html", event=event, msg="Invalid file format"
+                        "event_upload.html",
+                        event=event,
+                        msg="Invalid file format",
+                        batch_id=batch_id,
                     )
 
+            stored = {
+                photo["content_hash"]
+                for photo in mongo.db.images.find(
+                    {
+                        "event_id": event_id,
+                        "content_hash": {"$in": [upload[3] for upload in uploads]},
+                    },
+                    {"content_hash": 1},
+                )
+            }
+            skipped = 0
+            for img_id, file_ext, file_path, img_hash in uploads:
+                job = find_job(event_id, img_hash)
+                if img_hash in stored or job:
+                    # Unfinished jobs move into this batch, the copy is not needed
+                    if not job or not resume_job(job, batch_id):
+                        skipped += 1
+                    os.remove(file_path)
+                elif not enqueue_job(
+                    batch_id, current_user.id, event_id, img_id, file_path, file_ext, img_hash
+                ):
+                    # Same content queued by a concurrent upload
+                    os.remove(file_path)
+                    skipped += 1
+
+            msg = "Files uploaded, processing faces..."
+            if skipped:
+                msg += f" {skipped} already uploaded files skipped"
             return render_template(
-                "event_upload.html", event=event, msg="Files uploaded successfully"
+                "event_upload.html",
+                event=event,
+                msg=msg,
+                batch_id=batch_id,
             )
 
         return render_template("event_upload.html", event=event)
@@ -362,31 +543,25 @@ def event_upload(event_id):
     return redirect(url_for("dashboard"))
 
 
+@app.route("/upload/status/<batch_id>", methods=["GET"])
+@login_required
+def upload_status(batch_id):
+    return jsonify(batch_status(batch_id, current_user.id))
+
+
 @app.route("/faces/<event_id>")
 @login_required
 def faces(event_id):
-    faces = mongo.db.faces
     events = mongo.db.events
     event = events.find_one({"id": event_id})
     if event:
         event = Event.make_from_dict(event)
 
-        image_files = {}
-
-        face_object = faces.find({"event_id": event_id})
-        face_object = list(face_object)
-
-        image_files = [
-            {
-                "image_path": get_url(
-                    "{}/{}/faces/{}.png".format(current_user.id, event_id, face.id)
-                ),
-                "face_obj": face,
-            }
-            for face in [Face.make_from_dict(face) for face in face_object]
-        ]
+        image_files, next_cursor = event_faces_page(event_id)
 
-        return render_template("faces.html", image_files=image_files, event=event)
+        return render_template(
+            "faces.html", image_files=image_files, event=event, next_cursor=next_cursor
+        )
 
     return redirect(url_for("dashboard"))
 
@@ -395,60 +570,72 @@ def faces(event_id):
 @login_required
 def view_face(face_id):
     faces = mongo.db.faces
-    face = faces.find_one({"id": face_id})
+    face = faces.find_one({"id": face_id}, {"images": 0})
     if face:
         face = Face.make_from_dict(face)
 
-        # Prepare image_files for the current face
-        image_files = []
-
-        # For each image, query for other faces in the same image
-        for image in face.images:
-            img_id = image["img_id"]
-            
-            # Find other faces in the same image
-            other_faces = faces.find({
-                "images": {"$elemMatch": {"img_id": img_id}},
-                "id": {"$ne": face_id}  # Exclude the current face
-            })
-
-            # Process other faces
-            other_faces_list = []
-            for other_face in other_faces:
-                # Construct face_data for each other face
-                for other_image in other_face['images']:
-                    if other_image['img_id'] == img_id:
-                        face_data = {
-                            'id': other_face['id'],
-                            'name': other_face['name'],
-                            'face_location': other_image['face_location']
-                        }
-                        other_faces_list.append(face_data)
-                        break  # To avoid duplicate entries
-
-            # Append image file entry with other faces
-            image_files.append({
-                "image_path": get_url("{}/{}/{}".format(current_user.id, face.event_id, img_id)),
-                "face": {
-                            'id': face.id,
-                            'name': face.name,
-                            'face_location': image['face_location']
-                        },
-                "other_faces": other_faces_list
-            })
-
-        return render_template("face_details.html", face=face, image_files=image_files)
+        image_files, next_cursor = face_images_page(face)
+
+        return render_template(
+            "face_details.html",
+            face=face,
+            image_files=image_files,
+            next_cursor=next_cursor,
+        )
 
     return redirect(url_for("dashboard"))
 
 
+# Paginated JSON for infinite scroll
+@app.route("/api/event/<event_id>/images", methods=["GET"])
+@login_required
+def api_event_images(event_id):
+    try:
+        items, next_cursor = event_images_page(event_id, request.args.get("cursor"))
+    except InvalidId:
+        return abort(400)
+    return jsonify({"items": items, "next_cursor": next_cursor})
+
+
+@app.route("/api/event/<event_id>/faces", methods=["GET"])
+@login_required
+def api_event_faces(event_id):
+    try:
+        items, next_cursor = event_faces_page(event_id, request.args.get("cursor"))
+    except InvalidId:
+        return abort(400)
+    return jsonify({"items": items, "next_cursor": next_cursor})
+
+
+@app.route("/api/face/<face_id>/images", methods=["GET"])
+@login_required
+def api_face_images(face_id):
+    face = mongo.db.faces.find_one({"id": face_id}, {"images": 0})
+    if not face:
+        return abort(404)
+    face = Face.make_from_dict(face)
+    try:
+        items, next_cursor = face_images_page(face, request.args.get("cursor"))
+    except InvalidId:
+        return abort(400)
+    return jsonify({"items": items, "next_cursor": next_cursor})
+
+
 @app.route("/update_name", methods=["POST"])
+@login_required
 def update_name():
     new_name = request.form["name"]
     face_id = request.form["face_id"]
 
     # Save the updated face document back to the database
-    if mongo.db.faces.update_one({"id": face_id}, {"$set": {"name": new_name}}):
+    face = mongo.db.faces.find_one_and_update(
+        {"id": face_id}, {"$set": {"name": new_name}}, projection={"event_id": 1}
+    )
+    if face:
+        # The sidebar of the event's owner shows the name
+        event = mongo.db.events.find_one({"id": face["event_id"]}, {"user_id": 1})
+        if event:
+            invalidate_user_events(mongo.db, event["user_id"])
         return jsonify({"status": "success", "message": "Name updated successfully"})
     else:
         return jsonify({"status": "error", "message": "Face not found"})
@@ -459,28 +646,32 @@ def update_name():
 @login_required
 def face_download(face_id):
     faces = mongo.db.faces
-    face = faces.find_one({"id": face_id})
+    face = faces.find_one({"id": face_id}, {"images": 0})
     if face:
         face = Face.make_from_dict(face)
 
-        files_to_zip = []
-        for image in face.images:
-            files_to_zip.append(
-                f"{str(current_user.id)}/{str(face.event_id)}/{image['img_id']}"
+        # Photo paths come from the manifest
+        img_ids = [
+            occurrence["img_id"]
+            for occurrence in mongo.db.occurrences.find(
+                {"face_id": face.id}, {"img_id": 1}
             )
+        ]
+        files_to_zip = [
+            photo["path"]
+            for photo in mongo.db.images.find(
+                {"event_id": face.event_id, "id": {"$in": img_ids}}, {"path": 1}
+            )
+        ]
 
         zip_name = "{}.zip".format(face.id)
 
-        download_path = os.path.join("static", "downloads")
-        os.makedirs(download_path, exist_ok=True)
-
-        zip_file = os.path.join(download_path, zip_name)
-
-        remove_files_from_folder(download_path)
-
-        download_create_zip(download_path, files_to_zip, zip_file)
-
-        return send_file(zip_file, as_attachment=True)
+        # Stream the archive while photos are still downloading
+        return Response(
+            stream_zip(files_to_zip),
+            mimetype="application/zip",
+            headers={"Content-Disposition": f"attachment; filename={zip_name}"},
+        )
 
 
 # Profile
@@ -627,6 +818,188 @@ def delete_account():
     }
 
 
+# CLI COMMANDS
+
+
+# Run ingest workers in a dedicated process (set INGEST_WORKERS=0 for the web app)
+@app.cli.command("ingest-worker")
+@click.option("--workers", default=os.cpu_count() or 1, help="Number of face processes.")
+def ingest_worker(workers):
+    run_ingest(workers)
+
+
+# Merge duplicate faces of an event by clustering all its stored embeddings
+@app.cli.command("recluster")
+@click.argument("event_id")
+def recluster(event_id):
+    event = mongo.db.events.find_one({"id": event_id}, {"user_id": 1})
+    if not event:
+        raise click.ClickException(f"Event {event_id} not found")
+    user_id = event["user_id"]
+    stats = recluster_event(mongo.db, event_id, f"{user_id}/{event_id}/faces")
+    invalidate_user_events(mongo.db, user_id)
+    click.echo(
+        "Clustered {faces} faces into {clusters} ({merged} merged)".format(**stats)
+    )
+
+
+# Create the indexes declared in indexes.py, also done on every start
+@app.cli.command("create-indexes")
+def create_indexes():
+    ensure_indexes(mongo.db)
+    click.echo("Indexes created")
+
+
+# Explain the query of every hot path and fail if one scans a whole collection.
+# Run against a local mongod, the indexes are created first.
+@app.cli.command("check-query-plans")
+def check_query_plans_command():
+    ensure_indexes(mongo.db)
+    plans, scans = check_query_plans(mongo.db)
+    for name, stages in plans.items():
+        click.echo(f"{name}: {' <- '.join(stages)}")
+    if scans:
+        raise click.ClickException(f"Collection scans in: {', '.join(scans)}")
+
+
+# Show hit/miss counters of the local storage download cache
+@app.cli.command("cache-stats")
+def cache_stats():
+    for name, value in storage_cache.stats().items():
+        click.echo(f"{name}: {value}")
+
+
+# Wait for queued storage uploads to finish
+@app.cli.command("flush-uploads")
+@click.option("--timeout", type=float, default=None)
+@click.option("--retry-failed", is_flag=True, help="Retry uploads that gave up")
+def flush_uploads_command(timeout, retry_failed):
+    if retry_failed:
+        click.echo(f"{upload_queue.requeue_failed()} failed uploads requeued")
+    flushed = storage.flush(timeout)
+    for name, value in upload_queue.upload_stats().items():
+        click.echo(f"{name}: {value}")
+    if not flushed:
+        raise click.ClickException("Some uploads are still pending or failed")
+
+
+# Write photo manifest entries for photos uploaded before the manifest existed
+@app.cli.command("backfill-images")
+def backfill_images():
+    for event in mongo.db.events.find({}, {"id": 1, "user_id": 1}):
+        event_id = event["id"]
+        gallery_path = f"{event['user_id']}/{event_id}"
+        face_counts = {
+            row["_id"]: row["count"]
+            for row in mongo.db.occurrences.aggregate(
+                [
+                    {"$match": {"event_id": event_id}},
+                    {"$group": {"_id": "$img_id", "count": {"$sum": 1}}},
+                ]
+            )
+        }
+        count = 0
+        for entry in storage.list(gallery_path):
+            if entry["id"] is None:
+                continue
+            photo = Photo(
+                entry["name"],
+                event_id,
+                event["user_id"],
+                f"{gallery_path}/{entry['name']}",
+                (entry.get("metadata") or {}).get("size", 0),
+                face_count=face_counts.get(entry["name"], 0),
+            )
+            result = mongo.db.images.update_one(
+                {"id": photo.id, "event_id": event_id},
+                {"$setOnInsert": photo.dict()},
+                upsert=True,
+            )
+            count += 1 if result.upserted_id else 0
+        click.echo(f"Event {event_id}: {count} photos added")
+
+
+@app.cli.command("backfill-thumbnails")
+@click.option("--batch-size", default=64, show_default=True)
+def backfill_thumbnails(batch_size):
+    # Thumbnails for photos uploaded before they were made at ingest time
+    images = mongo.db.images
+    cursor = images.find(
+        {"thumb_path": None}, {"id": 1, "event_id": 1, "user_id": 1, "path": 1}
+    )
+    count = 0
+    while True:
+        photos = [photo for photo, _ in zip(cursor, range(batch_size))]
+        if not photos:
+            break
+        # Originals are read once, past the cache so they don't evict face crops
+        contents = storage.download_many([photo["path"] for photo in photos], cache=False)
+        files = []
+        for photo, img_bytes in zip(photos, contents):
+            thumbnail = thumbnail_from_bytes(img_bytes)
+            if thumbnail is None:
+                print(f"Error making thumbnail of {photo['path']}")
+                continue
+            photo["thumb_path"] = thumbnail_path(
+                f"{photo['user_id']}/{photo['event_id']}", photo["id"]
+            )
+            files.append((photo["thumb_path"], thumbnail, CONTENT_TYPE))
+        storage.upload_many(files)
+        for photo in photos:
+            if photo.get("thumb_path"):
+                images.update_one(
+                    {"_id": photo["_id"]}, {"$set": {"thumb_path": photo["thumb_path"]}}
+                )
+        count += len(files)
+    click.echo(f"{count} thumbnails created")
+
+
+# Move the per-photo and per-event arrays of older documents out to their own
+# collections and fields: faces.images to occurrences, users.events to
+# events.user_id, and drop events.faces. Safe to run again.
+@app.cli.command("migrate-arrays")
+def migrate_arrays():
+    occurrences = mongo.db.occurrences
+    moved = 0
+    for face in mongo.db.faces.find(
+        {"images": {"$exists": True}}, {"id": 1, "event_id": 1, "images": 1}
+    ):
+        # Skip sightings an earlier, interrupted run already copied
+        known = {
+            occurrence["img_id"]
+            for occurrence in occurrences.find({"face_id": face["id"]}, {"img_id": 1})
+        }
+        missing = [
+            Occurrence(
+                face["id"],
+                image["img_id"],
+                face["event_id"],
+                image["face_location"],
+                image.get("distance"),
+            ).dict()
+            for image in face["images"]
+            if image["img_id"] not in known
+        ]
+        if missing:
+            occurrences.insert_many(missing, ordered=False)
+            moved += len(missing)
+        mongo.db.faces.update_one({"_id": face["_id"]}, {"$unset": {"images": ""}})
+    click.echo(f"{moved} face sightings moved to occurrences")
+
+    owned = 0
+    for user in mongo.db.users.find({"events": {"$exists": True}}, {"id": 1, "events": 1}):
+        owned += mongo.db.events.update_many(
+            {"_id": {"$in": user["events"]}}, {"$set": {"user_id": user["id"]}}
+        ).modified_count
+        mongo.db.users.update_one(
+            {"_id": user["_id"]},
+            {"$unset": {"events": ""}, "$inc": {"events_version": 1}},
+        )
+    click.echo(f"{owned} events linked to their user")
+
+    mongo.db.events.update_many({"faces": {"$exists": True}}, {"$unset": {"faces": ""}})
+
+
 # LOGIN MANAGER REQUIREMENTS
 
 
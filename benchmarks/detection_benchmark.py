@@ -0,0 +1,94 @@
+# Compare detection time and recall at several detection sizes against
+# detection at full resolution. Photos are upscaled to DSLR size first so the
+# sample images behave like 24 megapixel uploads.
+#
+#   python benchmarks/detection_benchmark.py cld-sample.jpg --sizes 0 960 1600
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deepface_function import detect_faces
+from embedding_store import represent_faces
+from thumbnails import decode_image
+
+
+def load_photo(path, upscale_to):
+    with open(path, "rb") as f:
+        img = cv2.imdecode(np.frombuffer(f.read(), np.uint8), cv2.IMREAD_COLOR)
+    h, w = img.shape[:2]
+    if upscale_to and max(h, w) < upscale_to:
+        factor = upscale_to / max(h, w)
+        img = cv2.resize(img, (round(w * factor), round(h * factor)))
+    return cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 92])[1].tobytes()
+
+
+def iou(a, b):
+    x1, y1 = max(a["x"], b["x"]), max(a["y"], b["y"])
+    x2 = min(a["x"] + a["w"], b["x"] + b["w"])
+    y2 = min(a["y"] + a["h"], b["y"] + b["h"])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    union = a["w"] * a["h"] + b["w"] * b["h"] - inter
+    return inter / union if union else 0.0
+
+
+def run(img_bytes, detection_size, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        img = decode_image(img_bytes)
+        detections = detect_faces(img, detection_size)
+        times.append(time.perf_counter() - start)
+    embeddings = represent_faces([aligned for _, _, aligned in detections])
+    return min(times), [area for _, area, _ in detections], embeddings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("photos", nargs="*", default=["cld-sample.jpg"])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[640, 960, 1280, 1600, 2048])
+    parser.add_argument("--upscale-to", type=int, default=6000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--iou", type=float, default=0.5)
+    args = parser.parse_args()
+
+    photos = [load_photo(path, args.upscale_to) for path in args.photos]
+    # Build the models before timing anything
+    detect_faces(decode_image(photos[0]), 640)
+
+    # Full resolution detection is the reference
+    reference = [run(img_bytes, 0, args.repeat) for img_bytes in photos]
+    full_time = sum(result[0] for result in reference)
+    total_faces = sum(len(result[1]) for result in reference)
+    print(f"photos={len(photos)} faces at full resolution={total_faces}")
+    print(f"full       {1000 * full_time / len(photos):9.1f} ms/photo")
+
+    for size in args.sizes:
+        elapsed, found, similarities = 0.0, 0, []
+        for img_bytes, (_, ref_areas, ref_embeddings) in zip(photos, reference):
+            seconds, areas, embeddings = run(img_bytes, size, args.repeat)
+            elapsed += seconds
+            for ref_area, ref_embedding in zip(ref_areas, ref_embeddings):
+                overlaps = [iou(ref_area, area) for area in areas]
+                if overlaps and max(overlaps) >= args.iou:
+                    found += 1
+                    # Agreement of the full resolution crop's embedding
+                    match = embeddings[int(np.argmax(overlaps))]
+                    similarities.append(float(ref_embedding @ match))
+        recall = found / total_faces if total_faces else 1.0
+        similarity = np.mean(similarities) if similarities else float("nan")
+        print(
+            f"size={size:<5} {1000 * elapsed / len(photos):9.1f} ms/photo"
+            f"  speedup={full_time / elapsed:5.1f}x  recall={recall:.3f}"
+            f"  embedding cosine={similarity:.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# Compare recall and latency of the exact matcher, its PCA prefilter and the IVF
+# matcher on synthetic ArcFace-sized embeddings.
+#
+#   python benchmarks/matcher_benchmark.py --faces 20000 --queries 500
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from matcher import ExactMatcher, IVFMatcher
+
+
+def synthetic_faces(num_faces, num_queries, dim, latent_dim, noise, seed):
+    rng = np.random.default_rng(seed)
+    # Face embeddings concentrate near a lower-dimensional subspace
+    basis = np.linalg.qr(rng.standard_normal((dim, latent_dim)))[0].T
+    library = (rng.standard_normal((num_faces, latent_dim)) @ basis).astype(np.float32)
+    library += 0.1 * rng.standard_normal((num_faces, dim)).astype(np.float32) / np.sqrt(dim)
+    library /= np.linalg.norm(library, axis=1, keepdims=True)
+    # Queries are noisy views of random library faces
+    targets = rng.integers(0, num_faces, num_queries)
+    queries = library[targets] + noise * rng.standard_normal((num_queries, dim)).astype(
+        np.float32
+    ) / np.sqrt(dim)
+    return library, queries, targets
+
+
+def run(matcher, queries):
+    start = time.perf_counter()
+    results = [matcher.nearest(query)[0] for query in queries]
+    elapsed = time.perf_counter() - start
+    return results, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--faces", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--latent-dim", type=int, default=64)
+    parser.add_argument("--noise", type=float, default=0.8)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    library, queries, targets = synthetic_faces(
+        args.faces, args.queries, args.dim, args.latent_dim, args.noise, args.seed
+    )
+    ids = [str(i) for i in range(args.faces)]
+
+    exact = ExactMatcher(ids, library)
+    # Full scan without the projection prefilter is the ground truth
+    prefilter = exact.projection
+    exact.projection = None
+    exact_results, exact_time = run(exact, queries)
+    accuracy = np.mean([r == str(t) for r, t in zip(exact_results, targets)])
+    print(f"faces={args.faces} queries={args.queries} dim={args.dim}")
+    print(
+        f"exact      {1000 * exact_time / args.queries:8.3f} ms/query"
+        f"  accuracy={accuracy:.3f}"
+    )
+
+    if prefilter is not None:
+        exact.projection = prefilter
+        prefilter_results, prefilter_time = run(exact, queries)
+        recall = np.mean([a == b for a, b in zip(prefilter_results, exact_results)])
+        print(
+            f"prefilter  {1000 * prefilter_time / args.queries:8.3f} ms/query"
+            f"  recall@1={recall:.3f}  speedup={exact_time / prefilter_time:.1f}x"
+        )
+
+    start = time.perf_counter()
+    ivf = IVFMatcher(ids, library)
+    if ivf.centroids is None:
+        ivf.train()
+    build_time = time.perf_counter() - start
+    print(f"ivf build  {build_time:8.3f} s  lists={len(ivf.centroids)}")
+
+    for nprobe in args.nprobe:
+        ivf.nprobe = nprobe
+        ivf_results, ivf_time = run(ivf, queries)
+        # Recall against the exact matcher's answers
+        recall = np.mean([a == b for a, b in zip(ivf_results, exact_results)])
+        print(
+            f"ivf np={nprobe:<3} {1000 * ivf_time / args.queries:8.3f} ms/query"
+            f"  recall@1={recall:.3f}  speedup={exact_time / ivf_time:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
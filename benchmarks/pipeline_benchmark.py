@@ -0,0 +1,191 @@
+# Run the face pipeline over a labeled photo set for every detector and model
+# combination and report throughput, per-stage latency, peak memory and how
+# well faces are grouped into people. Each combination runs in a fresh process
+# so peak RSS is its own.
+#
+# The photo set is a folder with one subfolder per person, holding photos in
+# which that person has the largest face. Without --photos, a set is made from
+# the people in cld-sample.jpg and augmented copies of them.
+#
+#   python benchmarks/pipeline_benchmark.py --detectors opencv yunet retinaface \
+#       --models ArcFace SFace
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import DETECTION_SIZE, MODEL_THRESHOLDS
+
+
+def augment(img, rng):
+    # A randomly flipped, rotated, relit, blurred and recompressed copy
+    if rng.random() < 0.5:
+        img = img[:, ::-1]
+    h, w = img.shape[:2]
+    rotation = cv2.getRotationMatrix2D((w / 2, h / 2), rng.uniform(-12, 12), 1.0)
+    img = cv2.warpAffine(np.ascontiguousarray(img), rotation, (w, h), borderMode=cv2.BORDER_REFLECT)
+    img = cv2.convertScaleAbs(img, alpha=rng.uniform(0.7, 1.3), beta=rng.uniform(-30, 30))
+    if rng.random() < 0.5:
+        img = cv2.GaussianBlur(img, (5, 5), 0)
+    quality = int(rng.integers(50, 95))
+    return cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+
+def synthetic_set(sample_path, copies, seed):
+    # Cut every person out of the sample with a margin around the face and
+    # make augmented photos of each
+    from deepface_function import detect_faces
+
+    img = cv2.imread(sample_path)
+    rng = np.random.default_rng(seed)
+    photos = []
+    for person, (_, area, _) in enumerate(detect_faces(img, 0, "opencv")):
+        margin = max(area["w"], area["h"])
+        top, left = max(0, area["y"] - margin), max(0, area["x"] - margin)
+        cutout = img[top : area["y"] + area["h"] + margin, left : area["x"] + area["w"] + margin]
+        photos.extend((str(person), augment(cutout, rng)) for _ in range(copies))
+    return photos
+
+
+def labeled_set(folder):
+    photos = []
+    for person in sorted(os.listdir(folder)):
+        person_folder = os.path.join(folder, person)
+        if not os.path.isdir(person_folder):
+            continue
+        for name in sorted(os.listdir(person_folder)):
+            with open(os.path.join(person_folder, name), "rb") as f:
+                photos.append((person, f.read()))
+    return photos
+
+
+def pairwise_f1(labels, clusters):
+    # Agreement between true people and found groups over all pairs of faces
+    labels = np.asarray(labels)
+    clusters = np.asarray(clusters)
+    same_label = labels[:, None] == labels[None, :]
+    same_cluster = clusters[:, None] == clusters[None, :]
+    upper = np.triu(np.ones_like(same_label), k=1)
+    true_pos = np.sum(same_label & same_cluster & upper)
+    precision = true_pos / max(1, np.sum(same_cluster & upper))
+    recall = true_pos / max(1, np.sum(same_label & upper))
+    return 2 * precision * recall / max(precision + recall, 1e-9)
+
+
+def run_combination(photos, detector, model, threshold, detection_size):
+    from deepface_function import detect_faces
+    from embedding_store import represent_faces
+    from matcher import ExactMatcher
+    from thumbnails import decode_image
+
+    # Build both models outside the timed loop
+    warmup = decode_image(photos[0][1])
+    detections = detect_faces(warmup, detection_size, detector)
+    represent_faces([aligned for _, _, aligned in detections][:1], model)
+
+    stages = {"decode": 0.0, "detect": 0.0, "embed": 0.0, "match": 0.0}
+    matcher = ExactMatcher()
+    labels, clusters = [], []
+    missed = 0
+    start = time.perf_counter()
+    for person, img_bytes in photos:
+        tick = time.perf_counter()
+        img = decode_image(img_bytes)
+        stages["decode"] += time.perf_counter() - tick
+
+        tick = time.perf_counter()
+        detections = detect_faces(img, detection_size, detector)
+        stages["detect"] += time.perf_counter() - tick
+        if not detections:
+            missed += 1
+            continue
+        # The labeled person is the largest face of the photo
+        largest = max(detections, key=lambda d: d[1]["w"] * d[1]["h"])
+
+        tick = time.perf_counter()
+        embedding = represent_faces([largest[2]], model)[0]
+        stages["embed"] += time.perf_counter() - tick
+
+        # Same rule as ingestion: join the nearest face within threshold
+        tick = time.perf_counter()
+        match = matcher.search([embedding], k=1)[0] if len(matcher) else []
+        if match and match[0][1] <= threshold:
+            cluster = match[0][0]
+        else:
+            cluster = str(len(matcher))
+            matcher.add([cluster], [embedding])
+        stages["match"] += time.perf_counter() - tick
+
+        labels.append(person)
+        clusters.append(cluster)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "images_per_second": len(photos) / elapsed,
+        "stages_ms": {name: 1000 * value / len(photos) for name, value in stages.items()},
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "missed": missed,
+        "people": len(set(labels)),
+        "groups": len(set(clusters)),
+        "f1": pairwise_f1(labels, clusters) if labels else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--photos", help="folder with one subfolder per person")
+    parser.add_argument("--sample", default="cld-sample.jpg")
+    parser.add_argument("--copies", type=int, default=8)
+    parser.add_argument("--detectors", nargs="+", default=["opencv", "ssd", "yunet", "mtcnn", "retinaface"])
+    parser.add_argument("--models", nargs="+", default=["ArcFace", "Facenet512", "SFace"])
+    parser.add_argument("--threshold", type=float, help="defaults to the model's threshold")
+    parser.add_argument("--detection-size", type=int, default=DETECTION_SIZE)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    photos = (
+        labeled_set(args.photos)
+        if args.photos
+        else synthetic_set(args.sample, args.copies, args.seed)
+    )
+    if not photos:
+        sys.exit("No photos to run on")
+    print(f"photos={len(photos)} people={len(set(person for person, _ in photos))}")
+    print(
+        f"{'detector':<11}{'model':<12}{'img/s':>7}{'decode':>8}{'detect':>8}"
+        f"{'embed':>8}{'match':>8}{'rss MB':>8}{'missed':>7}{'groups':>7}{'F1':>7}"
+    )
+
+    context = multiprocessing.get_context("spawn")
+    for detector in args.detectors:
+        for model in args.models:
+            threshold = args.threshold or MODEL_THRESHOLDS.get(model, 0.68)
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                try:
+                    result = executor.submit(
+                        run_combination, photos, detector, model, threshold, args.detection_size
+                    ).result()
+                except Exception as e:
+                    print(f"{detector:<11}{model:<12} failed: {e}")
+                    continue
+            stages = result["stages_ms"]
+            print(
+                f"{detector:<11}{model:<12}{result['images_per_second']:7.2f}"
+                f"{stages['decode']:8.1f}{stages['detect']:8.1f}{stages['embed']:8.1f}"
+                f"{stages['match']:8.2f}{result['peak_rss_mb']:8.0f}{result['missed']:7d}"
+                f"{result['groups']:7d}{result['f1']:7.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
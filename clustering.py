@@ -0,0 +1,65 @@
+import numpy as np
+
+# Graph clustering of face embeddings, used by recluster
+
+# Rows of the similarity matrix computed at once, bounds memory to
+# CHUNK_SIZE x faces floats
+CHUNK_SIZE = 1024
+# Rounds are cheap and stop once labels are stable, the cap only guards
+# against graphs that keep oscillating
+MAX_ITERATIONS = 100
+
+
+def similarity_edges(matrix, threshold, chunk_size=CHUNK_SIZE):
+    # Edges (i, j, similarity) with i < j between embeddings closer than threshold
+    min_similarity = 1.0 - threshold
+    sources, targets, weights = [], [], []
+    for start in range(0, len(matrix), chunk_size):
+        similarities = matrix[start : start + chunk_size] @ matrix.T
+        rows, cols = np.nonzero(similarities >= min_similarity)
+        rows_global = rows + start
+        upper = cols > rows_global
+        sources.append(rows_global[upper])
+        targets.append(cols[upper])
+        weights.append(similarities[rows[upper], cols[upper]])
+
+    if not sources:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32)
+    return np.concatenate(sources), np.concatenate(targets), np.concatenate(weights)
+
+
+def chinese_whispers(num_nodes, sources, targets, weights, seed=0):
+    # Every node repeatedly takes the label with the highest total edge weight
+    # among its neighbours. Updates are vectorised over the edge list and only
+    # a random half of the nodes moves per round so labels don't oscillate.
+    rng = np.random.default_rng(seed)
+    labels = np.arange(num_nodes)
+    if not len(sources):
+        return labels
+
+    src = np.concatenate([sources, targets])
+    dst = np.concatenate([targets, sources])
+    weight = np.concatenate([weights, weights])
+
+    for _ in range(MAX_ITERATIONS):
+        # Total weight each node receives per neighbouring label
+        keys, inverse = np.unique(src * num_nodes + labels[dst], return_inverse=True)
+        totals = np.bincount(inverse, weights=weight)
+        nodes = keys // num_nodes
+        candidates = keys % num_nodes
+
+        # Pick the heaviest label per node
+        order = np.lexsort((-totals, nodes))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = nodes[order][1:] != nodes[order][:-1]
+        best_nodes = nodes[order][first]
+        best_labels = candidates[order][first]
+
+        # Stable once every node already has its heaviest label, checked over
+        # all nodes rather than the half that moves
+        if np.array_equal(best_labels, labels[best_nodes]):
+            break
+        moving = rng.random(len(best_nodes)) < 0.5
+        labels[best_nodes[moving]] = best_labels[moving]
+
+    return labels
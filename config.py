@@ -0,0 +1,39 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Face pipeline settings, read from the environment. Run
+# benchmarks/pipeline_benchmark.py to compare detector and model combinations
+# before changing them.
+
+# opencv, ssd, mtcnn, retinaface, yunet, mediapipe, yolov8, centerface, dlib
+DETECTOR_BACKEND = os.getenv("FACE_DETECTOR", "opencv")
+# Embeddings are only comparable within one model. Faces embedded by another
+# model are re-embedded from their crops when their event's index is rebuilt.
+MODEL_NAME = os.getenv("FACE_MODEL", "ArcFace")
+
+# DeepFace's cosine distance thresholds per model
+MODEL_THRESHOLDS = {
+    "VGG-Face": 0.68,
+    "Facenet": 0.40,
+    "Facenet512": 0.30,
+    "ArcFace": 0.68,
+    "Dlib": 0.07,
+    "SFace": 0.593,
+    "OpenFace": 0.10,
+    "DeepFace": 0.23,
+    "DeepID": 0.015,
+    "GhostFaceNet": 0.65,
+}
+
+# Largest cosine distance counted as the same person
+DISTANCE_THRESHOLD = float(
+    os.getenv("FACE_MATCH_THRESHOLD", str(MODEL_THRESHOLDS.get(MODEL_NAME, 0.68)))
+)
+# Detections below this confidence are ignored
+MIN_CONFIDENCE = float(os.getenv("FACE_MIN_CONFIDENCE", "0.5"))
+# Longest side of the copy the detector runs on, 0 to detect at full
+# resolution. Faces are still cropped and embedded from the original.
+DETECTION_SIZE = int(os.getenv("DETECTION_SIZE", "1600"))
@@ -1,88 +1,248 @@
 import cv2
 from deepface import DeepFace
+import time
 import uuid
-import os
 
 import numpy as np
-from supabase_function import download_image, list_images, upload_image
-
-
-def face_compare(src_img, folder_path):
-    image_files = list_images(folder_path)
-    for image_file in image_files:
-        target_img = download_image(image_file)
-        exist = DeepFace.verify(src_img, target_img, enforce_detection=False, model_name="ArcFace")[
-            "verified"
-        ]
-        if exist:
-            img_id = os.path.basename(image_file).split(".")[0]
-            return True, img_id
-
-    img_id = uuid.uuid4().hex[:10]
-    img_path = f"{folder_path}/{img_id}.png"
-    upload_image(img_path, src_img)
-    return False, img_id
-
-
-def extract_faces_and_compare(img_bytes, img_name, folder_path):
-    # Extract faces
-    nparr = np.frombuffer(img_bytes, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    face_objs = DeepFace.extract_faces(img_path=img, enforce_detection=False)
-    results = []
+from pymongo import ReturnDocument
+from config import (
+    DETECTION_SIZE,
+    DETECTOR_BACKEND,
+    DISTANCE_THRESHOLD,
+    MIN_CONFIDENCE,
+    MODEL_NAME,
+)
+from embedding_store import represent_faces
+from occurrence import Occurrence
+from thumbnails import (
+    decode_image,
+    face_crop_path,
+    make_face_crop,
+    make_thumbnail,
+)
+
+
+def face_compare(faces, matcher, threshold=DISTANCE_THRESHOLD):
+    # Match every face of the image against the event index in one search and
+    # take the nearest face within threshold, with its distance
+    embeddings = [face["embedding"] for face in faces]
+    matches = matcher.search(embeddings, k=1) if len(faces) else []
 
-    for i, face_obj in enumerate(face_objs):
-        if face_obj["confidence"] < 0.5:
+    compared = []
+    for match in matches:
+        distance = match[0][1] if match else None
+        if match and distance <= threshold:
+            compared.append((True, match[0][0], distance))
             continue
-        roi = img[
-            face_obj["facial_area"]["y"] : face_obj["facial_area"]["y"]
-            + face_obj["facial_area"]["h"],
-            face_obj["facial_area"]["x"] : face_obj["facial_area"]["x"]
-            + face_obj["facial_area"]["w"],
-        ]
-
-        exist, id = face_compare(roi, folder_path)
+
+        compared.append((False, uuid.uuid4().hex[:10], distance))
+    return compared
+
+
+def downscale_for_detection(img, detection_size=DETECTION_SIZE):
+    # Copy of img with its longest side at most detection_size, and the factor
+    # from its coordinates back to img
+    h, w = img.shape[:2]
+    if not detection_size or max(h, w) <= detection_size:
+        return img, 1.0
+    factor = detection_size / max(h, w)
+    small = cv2.resize(
+        img,
+        (max(1, round(w * factor)), max(1, round(h * factor))),
+        interpolation=cv2.INTER_AREA,
+    )
+    return small, w / small.shape[1]
+
+
+def map_area(area, scale, shape):
+    # Box and eye positions of a detection on the downscaled copy, in original
+    # image coordinates and clipped to the image
+    h, w = shape[:2]
+    x = min(w - 1, max(0, round(area["x"] * scale)))
+    y = min(h - 1, max(0, round(area["y"] * scale)))
+    mapped = {
+        "x": x,
+        "y": y,
+        "w": max(1, min(w - x, round(area["w"] * scale))),
+        "h": max(1, min(h - y, round(area["h"] * scale))),
+    }
+    for eye in ("left_eye", "right_eye"):
+        if area.get(eye) is not None:
+            mapped[eye] = (area[eye][0] * scale, area[eye][1] * scale)
+    return mapped
+
+
+def align_crop(img, area):
+    # Full resolution crop of a face, rotated so the eyes are level when the
+    # detector found them
+    x, y, w, h = area["x"], area["y"], area["w"], area["h"]
+    eyes = [area.get("left_eye"), area.get("right_eye")]
+    if None in eyes:
+        return img[y : y + h, x : x + w]
+
+    (x1, y1), (x2, y2) = sorted(eyes)
+    angle = np.degrees(np.arctan2(y2 - y1, x2 - x1))
+    # Rotate a margin around the box so the corners stay filled
+    margin = max(w, h) // 2
+    top, left = max(0, y - margin), max(0, x - margin)
+    roi = img[top : y + h + margin, left : x + w + margin]
+    center = (x + w / 2 - left, y + h / 2 - top)
+    rotation = cv2.getRotationMatrix2D(center, angle, 1.0)
+    rotated = cv2.warpAffine(roi, rotation, (roi.shape[1], roi.shape[0]))
+    return rotated[y - top : y - top + h, x - left : x - left + w]
+
+
+def detect_faces(
+    img,
+    detection_size=DETECTION_SIZE,
+    detector_backend=DETECTOR_BACKEND,
+    min_confidence=MIN_CONFIDENCE,
+):
+    # Run the detector on a downscaled copy and return the confident faces
+    # with boxes in img coordinates and aligned crops to embed
+    small, scale = downscale_for_detection(img, detection_size)
+    face_objs = DeepFace.extract_faces(
+        img_path=small,
+        detector_backend=detector_backend,
+        enforce_detection=False,
+        align=True,
+    )
+    detections = []
+    for face_obj in face_objs:
+        if face_obj["confidence"] < min_confidence:
+            continue
+        if scale == 1.0:
+            # extract_faces returns RGB, the model expects BGR like cv2 images
+            area = face_obj["facial_area"]
+            aligned = face_obj["face"][:, :, ::-1]
+        else:
+            area = map_area(face_obj["facial_area"], scale, img.shape)
+            aligned = align_crop(img, area)
+        detections.append((face_obj["confidence"], area, aligned))
+    return detections
+
+
+def analyze_image(img_bytes):
+    # Detect, align and embed the faces of an image, without touching storage.
+    # Returns the image size, its thumbnail and the faces found with their
+    # encoded crops.
+    img = decode_image(img_bytes)
+    detections = detect_faces(img)
+
+    # Detected and aligned faces are embedded directly, so detection runs once
+    # per face
+    embeddings = represent_faces([aligned for _, _, aligned in detections])
+
+    faces = []
+    for (confidence, area, _), embedding in zip(detections, embeddings):
+        faces.append(
+            {
+                "face_location": {
+                    "x": area["x"],
+                    "y": area["y"],
+                    "w": area["w"],
+                    "h": area["h"],
+                },
+                "confidence": confidence,
+                "crop": make_face_crop(
+                    img[area["y"] : area["y"] + area["h"], area["x"] : area["x"] + area["w"]]
+                ),
+                "embedding": embedding,
+            }
+        )
+    return {
+        "width": img.shape[1],
+        "height": img.shape[0],
+        "thumbnail": make_thumbnail(img),
+        "faces": faces,
+    }
+
+
+def compare_faces(faces, img_name, folder_path, matcher):
+    results = []
+    for face, (exist, id, distance) in zip(faces, face_compare(faces, matcher)):
         results.append(
             {
                 "exist": exist,
                 "id": id,
+                # Distance to the nearest known face, None for an empty event
+                "distance": distance,
                 "img_id": img_name,
-                "face_location": {
-                    "x":face_obj["facial_area"]["x"],
-                    "y":face_obj["facial_area"]["y"],
-                    "w":face_obj["facial_area"]["w"],
-                    "h":face_obj["facial_area"]["h"],
-                },
+                "embedding": face["embedding"].tolist(),
+                "face_location": face["face_location"],
+                # Crop to upload for a new face
+                "crop_path": None if exist else face_crop_path(folder_path, id),
+                "crop": None if exist else face["crop"],
             }
         )
 
     return results
 
 
-def update_faces_collection(mongo, results, event_id):
+def update_faces_collection(db, results, event_id, matcher=None):
+    # Write the results of an image in a constant number of round trips: one
+    # to reserve sequence numbers, one insert of the new faces and one of the
+    # occurrences. Face and event documents hold no per-photo arrays, so their
+    # size stays constant however many photos a face appears in. Returns
+    # counts and the time spent in the database.
+    start = time.perf_counter()
+    new_results = [result for result in results if not result["exist"]]
+    new_count = len(new_results)
 
-    faces = mongo.db.faces
-    for result in results:
-
-        face_id = result["id"]
-        img_id = result["img_id"]
-        face_location = result["face_location"]
-        exist = result["exist"]
+    # Reserve a sequence number per new face so other processes can pick up
+    # exactly the faces added since their index was last synced
+    if new_count:
+        event = db.events.find_one_and_update(
+            {"id": event_id},
+            {"$inc": {"face_seq": new_count}},
+            projection={"face_seq": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        next_seq = event["face_seq"] - new_count + 1
 
-        if exist:
-            faces.update_one(
-                {"id": face_id}, {"$push": {"images": {"img_id": img_id, "face_location": face_location}}}
+        new_faces = []
+        for result in new_results:
+            new_faces.append(
+                {
+                    "id": result["id"],
+                    "event_id": event_id,
+                    "name": "unknown",
+                    "embedding": result["embedding"],
+                    "model": MODEL_NAME,
+                    "seq": next_seq,
+                    "crop_path": result.get("crop_path"),
+                }
             )
-        else:
-            new_face = {
-                "id": face_id,
-                "event_id": event_id,
-                "name": "unknown",
-                "images": [{"img_id": img_id, "face_location": face_location}],
-            }
-            inserted_face = faces.insert_one(new_face)
+            next_seq += 1
+        db.faces.insert_many(new_faces, ordered=False)
 
-            events = mongo.db.events
-            events.update_one(
-                {"id": event_id}, {"$push": {"faces": inserted_face.inserted_id}}
-            )
+    # Every sighting, of new and known faces, is one occurrence
+    if results:
+        db.occurrences.insert_many(
+            [
+                Occurrence(
+                    result["id"],
+                    result["img_id"],
+                    event_id,
+                    result["face_location"],
+                    result.get("distance") if result["exist"] else None,
+                ).dict()
+                for result in results
+            ],
+            ordered=False,
+        )
+    db_seconds = time.perf_counter() - start
+
+    # Make new faces searchable for the rest of the upload
+    if matcher is not None and new_count:
+        matcher.add(
+            [result["id"] for result in new_results],
+            [result["embedding"] for result in new_results],
+        )
+        matcher.seq = next_seq - 1
+
+    return {
+        "faces": len(results),
+        "new_faces": new_count,
+        "db_seconds": db_seconds,
+    }
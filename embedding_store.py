@@ -0,0 +1,189 @@
+from deepface import DeepFace
+import numpy as np
+import cv2
+import os
+
+from config import DETECTOR_BACKEND, MODEL_NAME
+from thumbnails import stored_crop_path
+from matcher import (
+    create_matcher,
+    delete_matcher,
+    index_path,
+    load_matcher,
+    save_matcher,
+)
+
+# Faces stored before the model was configurable have no model field
+DEFAULT_MODEL = "ArcFace"
+
+
+def normalize(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+_models = {}
+
+
+def get_model(model_name=MODEL_NAME):
+    # Build each recognition model once per process
+    if model_name not in _models:
+        _models[model_name] = DeepFace.build_model(model_name)
+    return _models[model_name]
+
+
+def prepare_face(img, target_size):
+    # Resize keeping aspect ratio and pad to the model's input size
+    target_h, target_w = target_size
+    h, w = img.shape[:2]
+    factor = min(target_h / h, target_w / w)
+    resized = cv2.resize(img, (max(1, int(w * factor)), max(1, int(h * factor))))
+    pad_h = target_h - resized.shape[0]
+    pad_w = target_w - resized.shape[1]
+    padded = np.pad(
+        resized,
+        ((pad_h // 2, pad_h - pad_h // 2), (pad_w // 2, pad_w - pad_w // 2), (0, 0)),
+        "constant",
+    ).astype(np.float32)
+    return padded / 255 if padded.max() > 1 else padded
+
+
+def represent_faces(imgs, model_name=MODEL_NAME):
+    # Embed all face crops in one batched forward pass
+    if not len(imgs):
+        return np.empty((0, 0), dtype=np.float32)
+    model = get_model(model_name)
+    batch = np.stack([prepare_face(img, model.input_shape) for img in imgs])
+    if hasattr(getattr(model, "model", None), "predict_on_batch"):
+        embeddings = model.model.predict_on_batch(batch)
+    else:
+        # Models that are not keras networks embed one face at a time
+        embeddings = [model.forward(face[np.newaxis]) for face in batch]
+    embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(imgs), -1)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+
+def represent_face(img):
+    embedding = DeepFace.represent(
+        img,
+        model_name=MODEL_NAME,
+        detector_backend=DETECTOR_BACKEND,
+        enforce_detection=False,
+    )[0]["embedding"]
+    return normalize(embedding)
+
+
+def _current_models():
+    # Model field values of embeddings made by the configured model
+    return [MODEL_NAME, None] if MODEL_NAME == DEFAULT_MODEL else [MODEL_NAME]
+
+
+# Events whose faces were brought to the configured model by this process
+_reembedded = set()
+
+
+def reembed_event_faces(db, event_id, folder_path):
+    # Faces created before embeddings were stored, or by another model, are
+    # embedded once from their crop and saved back on the face. Downloading
+    # and embedding is slow, so this runs before event_lock is taken, once per
+    # event and process: new faces always carry a current embedding.
+    if event_id in _reembedded:
+        return
+    # Imported here so detection and embedding work without storage access,
+    # as in the benchmarks
+    from supabase_function import download_image
+
+    faces = db.faces
+    query = {
+        "event_id": event_id,
+        "$or": [{"embedding": None}, {"model": {"$nin": _current_models()}}],
+    }
+    for face in faces.find(query, {"id": 1, "crop_path": 1}):
+        try:
+            crop = download_image(stored_crop_path(folder_path, face))
+        except Exception as e:
+            print(f"Error loading face crop {face['id']}: {e}")
+            continue
+        embedding = represent_face(crop)
+        faces.update_one(
+            {"id": face["id"]},
+            {"$set": {"embedding": embedding.tolist(), "model": MODEL_NAME}},
+        )
+    _reembedded.add(event_id)
+
+
+def _embedded_query(event_id):
+    # Faces with an embedding of the configured model, the ones an index holds.
+    # Faces whose crop could not be re-embedded are left out.
+    return {
+        "event_id": event_id,
+        "embedding": {"$ne": None},
+        "model": {"$in": _current_models()},
+    }
+
+
+def load_event_embeddings(db, event_id, after_seq=None):
+    query = _embedded_query(event_id)
+    if after_seq is not None:
+        query["seq"] = {"$gt": after_seq}
+
+    ids = []
+    vectors = []
+    max_seq = after_seq or 0
+    for face in db.faces.find(query, {"id": 1, "embedding": 1, "seq": 1}).sort("seq", 1):
+        ids.append(face["id"])
+        vectors.append(normalize(face["embedding"]))
+        max_seq = max(max_seq, face.get("seq", 0))
+
+    matrix = np.vstack(vectors) if vectors else None
+    return ids, matrix, max_seq
+
+
+# Matchers already loaded by this process, by event id
+_matchers = {}
+
+
+def get_matcher(db, event_id):
+    # Load the event's index from memory or disk and bring it up to date with
+    # faces added by other processes. Call under event_lock before matching,
+    # after reembed_event_faces.
+    matcher = _matchers.get(event_id)
+    path = index_path(event_id)
+    if matcher is None and os.path.exists(path):
+        try:
+            matcher = load_matcher(path)
+        except Exception as e:
+            print(f"Error loading face index for event {event_id}: {e}")
+
+    # Indexes built with another model are rebuilt from re-embedded faces
+    if matcher is not None and matcher.model != MODEL_NAME:
+        matcher = None
+
+    if matcher is not None:
+        ids, matrix, max_seq = load_event_embeddings(db, event_id, after_seq=matcher.seq)
+        if ids:
+            matcher.add(ids, matrix)
+            matcher.seq = max_seq
+        # Faces were removed or merged since the index was built. Only faces
+        # the index can hold are counted, so unembeddable ones don't force a
+        # rebuild on every photo.
+        if len(matcher) != db.faces.count_documents(_embedded_query(event_id)):
+            matcher = None
+
+    if matcher is None:
+        ids, matrix, max_seq = load_event_embeddings(db, event_id)
+        matcher = create_matcher(ids, matrix)
+        matcher.seq = max_seq
+        save_matcher(event_id, matcher)
+
+    _matchers[event_id] = matcher
+    return matcher
+
+
+def reset_matcher(event_id):
+    # Drop the event's index from memory and disk, it is rebuilt on next use
+    _matchers.pop(event_id, None)
+    delete_matcher(event_id)
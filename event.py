@@ -4,7 +4,7 @@ import uuid
 
 # User class
 class Event:
-    def __init__(self, title, location, start, end, desc, id=""):
+    def __init__(self, title, location, start, end, desc, id="", user_id=None):
         # Main initialiser
         self.title = title
         self.location = location
@@ -12,6 +12,8 @@ class Event:
         self.end = end
         self.desc = desc
         self.id = uuid.uuid4().hex if not id else id
+        # Owner of the event
+        self.user_id = user_id
 
     @classmethod
     def make_from_dict(cls, d):
@@ -23,6 +25,7 @@ class Event:
             d["end"],
             d["desc"],
             d["id"],
+            d.get("user_id"),
         )
 
     def dict(self):
@@ -34,6 +37,7 @@ class Event:
             "start": self.start,
             "end": self.end,
             "desc": self.desc,
+            "user_id": self.user_id,
         }
 
     def get_eid(self):
@@ -1,6 +1,7 @@
 # Face class
 class Face:
     def __init__(self, name, event_id, images, id):
+        # images is empty for migrated faces, whose photos are in occurrences
         # Main initialiser
         self.name = name
         self.event_id = event_id
@@ -13,7 +14,7 @@ class Face:
         return cls(
             d["name"],
             d["event_id"],
-            d["images"],
+            d.get("images", []),
             d["id"],
         )
 
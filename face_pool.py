@@ -0,0 +1,46 @@
+import multiprocessing
+import os
+
+import cv2
+import numpy as np
+from deepface import DeepFace
+
+from config import DETECTOR_BACKEND
+from deepface_function import analyze_image
+from embedding_store import get_model
+
+
+def preload_models():
+    # Runs once in every pool process: one compute thread per process, since
+    # the pool already spreads work across cores, then load both models
+    cv2.setNumThreads(1)
+    try:
+        import tensorflow as tf
+
+        tf.config.threading.set_intra_op_parallelism_threads(1)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    except Exception as e:
+        print(f"Error limiting tensorflow threads: {e}")
+
+    get_model()
+    # The detector is built lazily on first use, warm it up on a blank image
+    DeepFace.extract_faces(
+        img_path=np.zeros((64, 64, 3), dtype=np.uint8),
+        detector_backend=DETECTOR_BACKEND,
+        enforce_detection=False,
+    )
+
+
+# Pool of processes that detect and embed faces with models loaded at startup
+class FacePool:
+    def __init__(self, processes=None):
+        self.processes = processes or os.cpu_count() or 1
+        context = multiprocessing.get_context("spawn")
+        self.pool = context.Pool(self.processes, initializer=preload_models)
+
+    def analyze_async(self, img_bytes):
+        return self.pool.apply_async(analyze_image, (img_bytes,))
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
@@ -0,0 +1,99 @@
+from pymongo import ASCENDING
+from pymongo.errors import ConnectionFailure
+
+# Indexes every query of the app relies on, by collection. Each entry is the
+# index keys and its options.
+INDEXES = {
+    "users": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("email", ASCENDING)], {"unique": True}),
+    ],
+    "events": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("user_id", ASCENDING), ("_id", ASCENDING)], {}),
+    ],
+    "faces": [
+        ([("id", ASCENDING)], {"unique": True}),
+        # Pages of an event's faces
+        ([("event_id", ASCENDING), ("_id", ASCENDING)], {}),
+        # Incremental index sync, faces added after a sequence number
+        ([("event_id", ASCENDING), ("seq", ASCENDING)], {}),
+    ],
+    "occurrences": [
+        ([("face_id", ASCENDING), ("_id", ASCENDING)], {}),
+        ([("img_id", ASCENDING), ("face_id", ASCENDING)], {}),
+        ([("event_id", ASCENDING)], {}),
+    ],
+    "images": [
+        ([("event_id", ASCENDING), ("_id", ASCENDING)], {}),
+        ([("event_id", ASCENDING), ("id", ASCENDING)], {"unique": True}),
+        # Photos already uploaded to an event, by file content
+        ([("event_id", ASCENDING), ("content_hash", ASCENDING)], {}),
+    ],
+}
+
+# Representative query of every hot path: collection, filter and sort. Values
+# are placeholders, the plan only depends on the shape.
+QUERIES = {
+    "login": ("users", {"email": "user@example.com"}, None),
+    "load_user": ("users", {"id": "user"}, None),
+    "user_events": ("events", {"user_id": "user"}, [("_id", ASCENDING)]),
+    "view_event": ("events", {"id": "event"}, None),
+    "event_faces_page": ("faces", {"event_id": "event"}, [("_id", ASCENDING)]),
+    "event_face_previews": ("faces", {"event_id": {"$in": ["event"]}}, None),
+    "view_face": ("faces", {"id": "face"}, None),
+    "face_names": ("faces", {"id": {"$in": ["face"]}}, None),
+    "sync_matcher": ("faces", {"event_id": "event", "seq": {"$gt": 0}}, [("seq", ASCENDING)]),
+    "face_images_page": ("occurrences", {"face_id": "face"}, [("_id", ASCENDING)]),
+    "co_occurrences": (
+        "occurrences",
+        {"img_id": {"$in": ["image"]}, "face_id": {"$ne": "face"}},
+        None,
+    ),
+    "event_occurrences": ("occurrences", {"event_id": "event"}, None),
+    "event_images_page": ("images", {"event_id": "event"}, [("_id", ASCENDING)]),
+    "photos_by_id": ("images", {"event_id": "event", "id": {"$in": ["image"]}}, None),
+    "photo_by_hash": (
+        "images",
+        {"event_id": "event", "content_hash": {"$in": ["hash"]}},
+        None,
+    ),
+    "resumed_occurrences": ("occurrences", {"img_id": "image"}, None),
+}
+
+
+def ensure_indexes(db):
+    # Create missing indexes, existing ones are left as they are. One failure,
+    # such as duplicates blocking a unique index, does not stop the others.
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                db[collection].create_index(keys, **options)
+            except ConnectionFailure as e:
+                print(f"Error creating indexes: {e}")
+                return
+            except Exception as e:
+                print(f"Error creating index {keys} on {collection}: {e}")
+
+
+def _stages(plan):
+    # Every stage name of a plan tree
+    yield plan.get("stage")
+    for child in plan.get("inputStages", []) + [
+        plan[key] for key in ("inputStage", "queryPlan") if key in plan
+    ]:
+        yield from _stages(child)
+
+
+def check_query_plans(db):
+    # Winning plan stages of every query, and the names of those that scan the
+    # whole collection
+    plans = {}
+    for name, (collection, query, sort) in QUERIES.items():
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        winning_plan = cursor.explain()["queryPlanner"]["winningPlan"]
+        plans[name] = [stage for stage in _stages(winning_plan) if stage]
+    scans = [name for name, stages in plans.items() if "COLLSCAN" in stages]
+    return plans, scans
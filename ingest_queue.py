@@ -0,0 +1,234 @@
+import hashlib
+import pickle
+import shutil
+import time
+import uuid
+import os
+
+from local_db import connect_sqlite
+
+# Local job queue for uploaded photos, shared by the web app and ingest workers.
+# Each job records how far its photo got, received -> detected -> matched ->
+# stored, so a retried or resumed job skips the stages already done.
+QUEUE_DB = os.getenv("INGEST_QUEUE_DB", "ingest_queue.db")
+SPOOL_FOLDER = os.getenv("INGEST_SPOOL_FOLDER", "ingest_spool")
+# Running jobs not updated for this many seconds are assumed lost
+JOB_TIMEOUT = int(os.getenv("INGEST_JOB_TIMEOUT", "900"))
+CHUNK_SIZE = 1024 * 1024
+
+
+def connect():
+    return connect_sqlite(QUEUE_DB)
+
+
+def init_queue():
+    with connect() as conn:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                batch_id TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                event_id TEXT NOT NULL,
+                img_id TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                file_ext TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                stage TEXT NOT NULL DEFAULT 'received',
+                content_hash TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        # Queues created before jobs had stages
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if "stage" not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN stage TEXT NOT NULL DEFAULT 'received'")
+        if "content_hash" not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN content_hash TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch_id)")
+        # One job per photo content and event, older jobs have no hash
+        conn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS jobs_content ON jobs (event_id, content_hash)"
+        )
+
+
+def spool_file(user_id, event_id, img_id, stream):
+    # Persist the upload so the job survives until a worker picks it up. The
+    # stream is copied and hashed in chunks, returns the path and SHA-256.
+    folder = os.path.join(SPOOL_FOLDER, str(user_id), str(event_id))
+    os.makedirs(folder, exist_ok=True)
+    file_path = os.path.join(folder, img_id)
+    digest = hashlib.sha256()
+    with open(file_path, "wb") as f:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+            f.write(chunk)
+    return file_path, digest.hexdigest()
+
+
+def find_job(event_id, content_hash):
+    with connect() as conn:
+        job = conn.execute(
+            "SELECT * FROM jobs WHERE event_id = ? AND content_hash = ?",
+            (event_id, content_hash),
+        ).fetchone()
+    return dict(job) if job else None
+
+
+def resume_job(job, batch_id):
+    # Move an unfinished job into the new batch. Failed jobs, and running ones
+    # whose worker is gone, are queued again and continue from the stage they
+    # reached. Returns False for done jobs.
+    if job["status"] == "done":
+        return False
+    # updated_at only changes with the status, so re-uploading does not keep
+    # a running job from timing out
+    requeue = "status = 'failed' OR (status = 'running' AND updated_at < :stale)"
+    now = time.time()
+    with connect() as conn:
+        conn.execute(
+            f"UPDATE jobs SET batch_id = :batch_id,"
+            f" status = CASE WHEN {requeue} THEN 'queued' ELSE status END,"
+            f" updated_at = CASE WHEN {requeue} THEN :now ELSE updated_at END"
+            " WHERE id = :id",
+            {"batch_id": batch_id, "stale": now - JOB_TIMEOUT, "now": now, "id": job["id"]},
+        )
+    return True
+
+
+def enqueue_job(batch_id, user_id, event_id, img_id, file_path, file_ext, content_hash=None):
+    # Returns None when a job for the same content was queued meanwhile
+    now = time.time()
+    job_id = uuid.uuid4().hex
+    with connect() as conn:
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO jobs (id, batch_id, user_id, event_id, img_id, file_path,"
+            " file_ext, status, content_hash, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, 'queued', ?, ?, ?)",
+            (
+                job_id,
+                batch_id,
+                user_id,
+                event_id,
+                img_id,
+                file_path,
+                file_ext,
+                content_hash,
+                now,
+                now,
+            ),
+        )
+    return job_id if cursor.rowcount else None
+
+
+def claim_jobs(limit=1):
+    # Atomically move the oldest queued jobs to running
+    with connect() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            jobs = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT ?",
+                (limit,),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?",
+                [(time.time(), job["id"]) for job in jobs],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    return [dict(job) for job in jobs]
+
+
+def set_stage(job_id, stage):
+    # Also keeps the job from being taken for lost while it runs
+    with connect() as conn:
+        conn.execute(
+            "UPDATE jobs SET stage = ?, updated_at = ? WHERE id = ?",
+            (stage, time.time(), job_id),
+        )
+
+
+def analysis_path(job):
+    return job["file_path"] + ".analysis"
+
+
+def save_analysis(job, analysis):
+    # Detection results are kept next to the spooled photo until it is stored
+    with open(analysis_path(job), "wb") as f:
+        pickle.dump(analysis, f)
+
+
+def load_analysis(job):
+    with open(analysis_path(job), "rb") as f:
+        return pickle.load(f)
+
+
+def finish_job(job):
+    with connect() as conn:
+        conn.execute(
+            "UPDATE jobs SET status = 'done', stage = 'stored', error = NULL, updated_at = ?"
+            " WHERE id = ?",
+            (time.time(), job["id"]),
+        )
+    try:
+        os.remove(analysis_path(job))
+    except FileNotFoundError:
+        pass
+
+
+def fail_job(job_id, error):
+    with connect() as conn:
+        conn.execute(
+            "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+            (str(error), time.time(), job_id),
+        )
+
+
+def requeue_stale_jobs():
+    with connect() as conn:
+        conn.execute(
+            "UPDATE jobs SET status = 'queued', updated_at = ?"
+            " WHERE status = 'running' AND updated_at < ?",
+            (time.time(), time.time() - JOB_TIMEOUT),
+        )
+
+
+def cancel_event_jobs(user_id, event_id):
+    # Drop the jobs of a deleted event and its spooled photos
+    with connect() as conn:
+        conn.execute("DELETE FROM jobs WHERE event_id = ?", (event_id,))
+    shutil.rmtree(
+        os.path.join(SPOOL_FOLDER, str(user_id), str(event_id)), ignore_errors=True
+    )
+
+
+def batch_status(batch_id, user_id):
+    with connect() as conn:
+        rows = conn.execute(
+            "SELECT status, COUNT(*) AS count FROM jobs"
+            " WHERE batch_id = ? AND user_id = ? GROUP BY status",
+            (batch_id, user_id),
+        ).fetchall()
+        errors = conn.execute(
+            "SELECT img_id, error FROM jobs"
+            " WHERE batch_id = ? AND user_id = ? AND status = 'failed'",
+            (batch_id, user_id),
+        ).fetchall()
+
+    counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+    for row in rows:
+        counts[row["status"]] = row["count"]
+    total = sum(counts.values())
+    return {
+        "batch_id": batch_id,
+        "total": total,
+        **counts,
+        "finished": total > 0 and counts["done"] + counts["failed"] == total,
+        "errors": [dict(error) for error in errors],
+    }
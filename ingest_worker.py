@@ -0,0 +1,210 @@
+from pymongo import MongoClient
+from dotenv import load_dotenv
+import multiprocessing
+import threading
+import time
+import os
+
+from deepface_function import compare_faces, update_faces_collection
+from embedding_store import get_matcher, reembed_event_faces
+from face_pool import FacePool
+from locks import event_lock
+from photo import Photo
+from user_events import invalidate_user_events
+from matcher import save_matcher
+from supabase_function import storage, upload_files, upload_file_later
+from thumbnails import CONTENT_TYPE, thumbnail_path
+from ingest_queue import (
+    init_queue,
+    claim_jobs,
+    finish_job,
+    fail_job,
+    requeue_stale_jobs,
+    set_stage,
+    save_analysis,
+    load_analysis,
+)
+
+load_dotenv()
+
+# Face processing processes started by the web app, 0 to use `flask ingest-worker`
+NUM_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+POLL_INTERVAL = float(os.getenv("INGEST_POLL_INTERVAL", "1"))
+# Seconds between checks for jobs left running by a worker that died
+STALE_CHECK_INTERVAL = 60
+# Seconds to wait for a photo's faces. A pool process that dies, out of memory
+# on a huge photo for example, is replaced but never returns its result.
+ANALYZE_TIMEOUT = int(os.getenv("INGEST_ANALYZE_TIMEOUT", "300"))
+
+
+def get_db():
+    return MongoClient(os.getenv("MONGO_URI")).get_default_database()
+
+
+def match_faces(db, job, faces):
+    facelib_path = f"{job['user_id']}/{job['event_id']}/faces"
+
+    reembed_event_faces(db, job["event_id"], facelib_path)
+    # Matching and creating faces is atomic per event across all processes,
+    # so concurrent uploads of the same new person create a single face
+    with event_lock(db, job["event_id"]) as held:
+        matcher = get_matcher(db, job["event_id"])
+        # Occurrences are written in one insert, so if they exist an earlier
+        # attempt matched the photo. Faces it created without getting that far
+        # are in the matcher and are matched again rather than duplicated.
+        if db.occurrences.find_one({"img_id": job["img_id"]}, {"_id": 1}):
+            return matcher, {"faces": 0, "new_faces": 0, "db_seconds": 0}
+        results = compare_faces(faces, job["img_id"], facelib_path, matcher)
+        # Crops of all new faces go out in parallel
+        upload_files(
+            [
+                (result["crop_path"], result["crop"], CONTENT_TYPE)
+                for result in results
+                if result["crop"] is not None
+            ]
+        )
+        # Another process may be creating the same faces once the lease is lost
+        if not held():
+            raise RuntimeError(f"Lost the lock on event {job['event_id']}")
+        stats = update_faces_collection(db, results, job["event_id"], matcher)
+    if stats["new_faces"]:
+        # The sidebar shows the event's faces
+        invalidate_user_events(db, job["user_id"])
+    return matcher, stats
+
+
+def store_photo(db, job, analysis):
+    # The spooled original is gone once an earlier attempt queued its upload
+    if not os.path.exists(job["file_path"]):
+        return
+    event_path = f"{job['user_id']}/{job['event_id']}"
+    img_path = f"{event_path}/{job['img_id']}"
+
+    # Storage writes are queued and sent in the background, the spooled
+    # original moves into the upload spool instead of being copied
+    thumb_path = None
+    if analysis.get("thumbnail") is not None:
+        thumb_path = thumbnail_path(event_path, job["img_id"])
+        upload_files([(thumb_path, analysis["thumbnail"], CONTENT_TYPE)])
+
+    # Galleries and exports read the photo manifest instead of listing storage
+    photo = Photo(
+        job["img_id"],
+        job["event_id"],
+        job["user_id"],
+        img_path,
+        os.path.getsize(job["file_path"]),
+        analysis["width"],
+        analysis["height"],
+        len(analysis["faces"]),
+        thumb_path=thumb_path,
+        content_hash=job["content_hash"],
+    )
+    db.images.replace_one(
+        {"event_id": job["event_id"], "id": job["img_id"]}, photo.dict(), upsert=True
+    )
+
+    upload_file_later(img_path, job["file_path"], f"image/{job['file_ext']}")
+
+
+def store_results(db, job, analysis):
+    # Each stage is recorded as it completes, so a retried job resumes from
+    # the last one instead of detecting and matching the photo again. analysis
+    # is the pending detection, None when it was saved by an earlier attempt.
+
+    # Jobs of deleted events are cancelled, but this worker may hold some
+    if not db.events.find_one({"id": job["event_id"]}, {"_id": 1}):
+        raise ValueError(f"Event {job['event_id']} was deleted")
+
+    if analysis is not None:
+        try:
+            analysis = analysis.get(ANALYZE_TIMEOUT)
+        except multiprocessing.TimeoutError:
+            raise RuntimeError(f"Face analysis took over {ANALYZE_TIMEOUT} s")
+        save_analysis(job, analysis)
+        set_stage(job["id"], "detected")
+    else:
+        analysis = load_analysis(job)
+
+    matcher, stats = None, {"faces": 0, "new_faces": 0, "db_seconds": 0}
+    if job["stage"] in ("received", "detected"):
+        matcher, stats = match_faces(db, job, analysis["faces"])
+        set_stage(job["id"], "matched")
+
+    store_photo(db, job, analysis)
+    return matcher, stats
+
+
+def run_ingest(num_workers=NUM_WORKERS):
+    # Detection and embedding run in the face pool, matching and database
+    # writes stay in this loop in the order the jobs were queued
+    init_queue()
+    # Resume uploads left in the spool by a previous run
+    storage.start_uploader()
+    db = get_db()
+    pool = FacePool(num_workers)
+    # Indexes changed since they were last written to disk, by event id
+    dirty = {}
+    last_stale_check = 0
+    while True:
+        # Other workers may die while this one runs, their jobs are taken
+        # over once they time out
+        if time.time() - last_stale_check >= STALE_CHECK_INTERVAL:
+            requeue_stale_jobs()
+            last_stale_check = time.time()
+
+        jobs = claim_jobs(2 * pool.processes)
+        if not jobs:
+            # Persist indexes while idle rather than after every photo
+            for event_id, matcher in dirty.items():
+                save_matcher(event_id, matcher)
+            dirty.clear()
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        pending = []
+        for job in jobs:
+            try:
+                # Photos detected by an earlier attempt skip the face pool
+                if job["stage"] != "received":
+                    pending.append((job, None))
+                    continue
+                with open(job["file_path"], "rb") as f:
+                    img_bytes = f.read()
+                pending.append((job, pool.analyze_async(img_bytes)))
+            except Exception as e:
+                print(f"Error reading job {job['id']}: {e}")
+                fail_job(job["id"], e)
+
+        # Database time per photo should stay flat however many faces it has
+        stored = faces = db_seconds = 0
+        for job, analysis in pending:
+            try:
+                matcher, stats = store_results(db, job, analysis)
+                if matcher is not None:
+                    dirty[job["event_id"]] = matcher
+                finish_job(job)
+                stored += 1
+                faces += stats["faces"]
+                db_seconds += stats["db_seconds"]
+            except Exception as e:
+                print(f"Error processing job {job['id']}: {e}")
+                fail_job(job["id"], e)
+        if stored:
+            print(
+                f"Stored {stored} photos with {faces} faces,"
+                f" {1000 * db_seconds / stored:.1f} ms face writes per photo"
+            )
+
+
+_ingest_thread = None
+
+
+def ensure_workers():
+    # Run the ingest loop in a background thread of the web app, started with
+    # the app so photos queued before a restart are processed
+    global _ingest_thread
+    if NUM_WORKERS <= 0 or (_ingest_thread and _ingest_thread.is_alive()):
+        return
+    _ingest_thread = threading.Thread(target=run_ingest, daemon=True)
+    _ingest_thread.start()
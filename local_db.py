@@ -0,0 +1,15 @@
+from contextlib import contextmanager
+import sqlite3
+
+
+@contextmanager
+def connect_sqlite(path):
+    # Autocommit connection for the local SQLite databases shared between
+    # processes, transactions are opened explicitly where needed
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        yield conn
+    finally:
+        conn.close()
@@ -0,0 +1,61 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
+import threading
+import time
+import uuid
+import os
+
+# Seconds before a lock held by a dead process can be taken over
+LOCK_TTL = int(os.getenv("EVENT_LOCK_TTL", "120"))
+LOCK_POLL_INTERVAL = 0.05
+
+
+@contextmanager
+def event_lock(db, event_id, ttl=LOCK_TTL):
+    # Lease lock on an event's face library, shared by every process using db.
+    # A heartbeat thread extends the lease while it is held. Yields a function
+    # telling whether the lock is still owned, to check before writing.
+    key = f"event:{event_id}"
+    owner = uuid.uuid4().hex
+    while True:
+        now = datetime.utcnow()
+        try:
+            # Matches only an expired lock, otherwise the upsert collides on _id
+            db.locks.update_one(
+                {"_id": key, "expires_at": {"$lt": now}},
+                {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=ttl)}},
+                upsert=True,
+            )
+            break
+        except DuplicateKeyError:
+            time.sleep(LOCK_POLL_INTERVAL)
+
+    stop = threading.Event()
+
+    def renew():
+        while not stop.wait(ttl / 3):
+            try:
+                db.locks.update_one(
+                    {"_id": key, "owner": owner},
+                    {"$set": {"expires_at": datetime.utcnow() + timedelta(seconds=ttl)}},
+                )
+            except Exception as e:
+                print(f"Error renewing lock {key}: {e}")
+
+    def held():
+        return bool(
+            db.locks.find_one(
+                {"_id": key, "owner": owner, "expires_at": {"$gt": datetime.utcnow()}},
+                {"_id": 1},
+            )
+        )
+
+    heartbeat = threading.Thread(target=renew, daemon=True)
+    heartbeat.start()
+    try:
+        yield held
+    finally:
+        stop.set()
+        heartbeat.join()
+        db.locks.delete_one({"_id": key, "owner": owner})
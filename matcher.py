@@ -0,0 +1,245 @@
+import numpy as np
+import os
+
+from config import MODEL_NAME
+
+INDEX_FOLDER = os.getenv("FACE_INDEX_FOLDER", "indexes")
+# "exact" or "ivf" (ivf falls back to exact search below FACE_IVF_MIN_SIZE faces)
+MATCHER_BACKEND = os.getenv("FACE_MATCHER", "ivf")
+IVF_MIN_SIZE = int(os.getenv("FACE_IVF_MIN_SIZE", "2000"))
+IVF_NPROBE = int(os.getenv("FACE_IVF_NPROBE", "16"))
+# Above this many candidates, rank them in a low-dimensional PCA projection
+# first and compute full distances for the best PREFILTER_CANDIDATES only
+PREFILTER_MIN_SIZE = int(os.getenv("FACE_PREFILTER_MIN_SIZE", "4096"))
+PREFILTER_CANDIDATES = int(os.getenv("FACE_PREFILTER_CANDIDATES", "256"))
+PREFILTER_DIM = 32
+
+
+def _normalize_rows(vectors):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+# Exact matcher, a linear scan over all embeddings of an event
+class ExactMatcher:
+    backend = "exact"
+
+    def __init__(self, ids=None, matrix=None):
+        # Highest face sequence number of the event included in the index
+        self.seq = 0
+        # Recognition model the embeddings come from
+        self.model = MODEL_NAME
+        self.ids = list(ids or [])
+        self.matrix = (
+            _normalize_rows(matrix)
+            if matrix is not None and len(self.ids)
+            else np.empty((0, 0), dtype=np.float32)
+        )
+        self.projection = None
+        self.projected = None
+        self._update_projection()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, ids, vectors):
+        if not len(ids):
+            return
+        vectors = _normalize_rows(vectors)
+        self.matrix = vectors if not len(self.ids) else np.vstack([self.matrix, vectors])
+        self.ids.extend(ids)
+        self._update_projection(vectors)
+
+    def _update_projection(self, new_vectors=None):
+        if self.projection is None:
+            if len(self.ids) < PREFILTER_MIN_SIZE:
+                return
+            # Top principal directions of a sample, fixed once computed
+            rng = np.random.default_rng(0)
+            sample = self.matrix[
+                rng.choice(len(self.ids), min(len(self.ids), 4096), replace=False)
+            ]
+            _, _, vt = np.linalg.svd(sample, full_matrices=False)
+            self.projection = np.ascontiguousarray(vt[:PREFILTER_DIM].T)
+            self.projected = self.matrix @ self.projection
+        elif new_vectors is not None:
+            self.projected = np.vstack([self.projected, new_vectors @ self.projection])
+
+    def _candidates(self, vector):
+        return None
+
+    def _prefilter(self, vector, candidates):
+        # Cheap ranking in the projection before the full distance computation
+        size = len(self.ids) if candidates is None else len(candidates)
+        if self.projection is None or size <= 4 * PREFILTER_CANDIDATES:
+            return candidates
+        projected = self.projected if candidates is None else self.projected[candidates]
+        scores = projected @ (vector @ self.projection)
+        top = np.argpartition(-scores, PREFILTER_CANDIDATES)[:PREFILTER_CANDIDATES]
+        return top if candidates is None else candidates[top]
+
+    def search(self, vectors, k=1):
+        # Return the k nearest (id, cosine distance) pairs for each query vector
+        vectors = _normalize_rows(vectors)
+        results = []
+        for vector in vectors:
+            if not len(self.ids):
+                results.append([])
+                continue
+            candidates = self._prefilter(vector, self._candidates(vector))
+            matrix = self.matrix if candidates is None else self.matrix[candidates]
+            distances = 1.0 - matrix @ vector
+            top = min(k, len(distances))
+            order = np.argpartition(distances, top - 1)[:top]
+            order = order[np.argsort(distances[order])]
+            indexes = order if candidates is None else candidates[order]
+            results.append(
+                [(self.ids[i], float(d)) for i, d in zip(indexes, distances[order])]
+            )
+        return results
+
+    def nearest(self, vector):
+        matches = self.search(vector, k=1)[0]
+        return matches[0] if matches else (None, None)
+
+    def state(self):
+        return {
+            "ids": np.array(self.ids, dtype=str),
+            "matrix": self.matrix,
+            "seq": self.seq,
+            "model": self.model,
+        }
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Per process, so workers saving the same index never share a file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, backend=self.backend, **self.state())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(state["ids"].tolist(), state["matrix"])
+
+
+# Inverted file index: embeddings are bucketed by their nearest k-means
+# centroid and a query only scans the buckets of its nprobe nearest centroids
+class IVFMatcher(ExactMatcher):
+    backend = "ivf"
+
+    def __init__(self, ids=None, matrix=None, nprobe=IVF_NPROBE):
+        super().__init__(ids, matrix)
+        self.nprobe = nprobe
+        self.centroids = None
+        self.assignments = np.empty(0, dtype=np.int32)
+        self.lists = []
+        self.trained_size = 0
+        if len(self.ids) >= IVF_MIN_SIZE:
+            self.train()
+
+    def train(self, iterations=10, seed=0):
+        rng = np.random.default_rng(seed)
+        nlist = max(1, int(np.sqrt(len(self.ids))))
+        sample_size = min(len(self.ids), nlist * 64)
+        sample = self.matrix[rng.choice(len(self.ids), sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)]
+        # Spherical k-means on a sample of the embeddings
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[labels == c]
+                if len(members):
+                    centroids[c] = members.sum(axis=0)
+            centroids = _normalize_rows(centroids)
+        self.centroids = centroids
+        self.assignments = self._assign(self.matrix)
+        self.trained_size = len(self.ids)
+        self._build_lists()
+
+    def _build_lists(self):
+        order = np.argsort(self.assignments, kind="stable")
+        bounds = np.searchsorted(
+            self.assignments[order], np.arange(len(self.centroids) + 1)
+        )
+        self.lists = [order[bounds[c] : bounds[c + 1]] for c in range(len(self.centroids))]
+
+    def _assign(self, vectors):
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    def add(self, ids, vectors):
+        if not len(ids):
+            return
+        super().add(ids, vectors)
+        if self.centroids is None:
+            if len(self.ids) >= IVF_MIN_SIZE:
+                self.train()
+        elif len(self.ids) > 4 * self.trained_size:
+            # Retrain once the index has outgrown its centroids
+            self.train()
+        else:
+            start = len(self.ids) - len(ids)
+            new_assignments = self._assign(self.matrix[start:])
+            self.assignments = np.concatenate([self.assignments, new_assignments])
+            for offset, c in enumerate(new_assignments):
+                self.lists[c] = np.append(self.lists[c], start + offset)
+
+    def _candidates(self, vector):
+        if self.centroids is None:
+            return None
+        nprobe = min(self.nprobe, len(self.centroids))
+        probes = np.argpartition(self.centroids @ vector, -nprobe)[-nprobe:]
+        candidates = np.concatenate([self.lists[c] for c in probes])
+        return candidates if len(candidates) else None
+
+    def state(self):
+        state = super().state()
+        state["nprobe"] = self.nprobe
+        state["trained_size"] = self.trained_size
+        state["assignments"] = self.assignments
+        if self.centroids is not None:
+            state["centroids"] = self.centroids
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        matcher = cls(nprobe=int(state["nprobe"]))
+        ExactMatcher.__init__(matcher, state["ids"].tolist(), state["matrix"])
+        matcher.trained_size = int(state["trained_size"])
+        matcher.assignments = state["assignments"]
+        if "centroids" in state:
+            matcher.centroids = state["centroids"]
+            matcher._build_lists()
+        return matcher
+
+
+MATCHERS = {"exact": ExactMatcher, "ivf": IVFMatcher}
+
+
+def create_matcher(ids=None, matrix=None, backend=MATCHER_BACKEND):
+    return MATCHERS[backend](ids, matrix)
+
+
+def index_path(event_id):
+    return os.path.join(INDEX_FOLDER, f"{event_id}.npz")
+
+
+def save_matcher(event_id, matcher):
+    matcher.save(index_path(event_id))
+
+
+def load_matcher(path):
+    with np.load(path) as data:
+        state = {name: data[name] for name in data.files}
+    matcher = MATCHERS[str(state["backend"])].from_state(state)
+    matcher.seq = int(state["seq"]) if "seq" in state else 0
+    matcher.model = str(state["model"]) if "model" in state else "ArcFace"
+    return matcher
+
+
+def delete_matcher(event_id):
+    path = index_path(event_id)
+    if os.path.exists(path):
+        os.remove(path)
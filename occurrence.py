@@ -0,0 +1,31 @@
+# Occurrence class, one face seen in one photo in the occurrences collection
+class Occurrence:
+    def __init__(self, face_id, img_id, event_id, face_location, distance=None):
+        # Main initialiser
+        self.face_id = face_id
+        self.img_id = img_id
+        self.event_id = event_id
+        self.face_location = face_location
+        # Distance to the face it was matched to, None for a new face
+        self.distance = distance
+
+    @classmethod
+    def make_from_dict(cls, d):
+        # Initialise Occurrence object from a dictionary
+        return cls(
+            d["face_id"],
+            d["img_id"],
+            d["event_id"],
+            d["face_location"],
+            d.get("distance"),
+        )
+
+    def dict(self):
+        # Return dictionary representation of the object
+        return {
+            "face_id": self.face_id,
+            "img_id": self.img_id,
+            "event_id": self.event_id,
+            "face_location": self.face_location,
+            "distance": self.distance,
+        }
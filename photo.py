@@ -0,0 +1,66 @@
+from datetime import datetime
+
+
+# Photo class, one uploaded image in the images collection
+class Photo:
+    def __init__(
+        self,
+        id,
+        event_id,
+        user_id,
+        path,
+        size,
+        width=None,
+        height=None,
+        face_count=0,
+        uploaded_at=None,
+        thumb_path=None,
+        content_hash=None,
+    ):
+        # Main initialiser
+        self.id = id
+        self.event_id = event_id
+        self.user_id = user_id
+        self.path = path
+        self.size = size
+        self.width = width
+        self.height = height
+        self.face_count = face_count
+        self.uploaded_at = uploaded_at or datetime.utcnow()
+        # Gallery thumbnail, None for photos uploaded before thumbnails
+        self.thumb_path = thumb_path
+        # SHA-256 of the file, None for photos uploaded before it was recorded
+        self.content_hash = content_hash
+
+    @classmethod
+    def make_from_dict(cls, d):
+        # Initialise Photo object from a dictionary
+        return cls(
+            d["id"],
+            d["event_id"],
+            d["user_id"],
+            d["path"],
+            d["size"],
+            d.get("width"),
+            d.get("height"),
+            d.get("face_count", 0),
+            d.get("uploaded_at"),
+            d.get("thumb_path"),
+            d.get("content_hash"),
+        )
+
+    def dict(self):
+        # Return dictionary representation of the object
+        return {
+            "id": self.id,
+            "event_id": self.event_id,
+            "user_id": self.user_id,
+            "path": self.path,
+            "size": self.size,
+            "width": self.width,
+            "height": self.height,
+            "face_count": self.face_count,
+            "uploaded_at": self.uploaded_at,
+            "thumb_path": self.thumb_path,
+            "content_hash": self.content_hash,
+        }
@@ -0,0 +1,90 @@
+from pymongo import UpdateMany
+import time
+
+from clustering import chinese_whispers, similarity_edges
+from config import DISTANCE_THRESHOLD
+from embedding_store import load_event_embeddings, reembed_event_faces, reset_matcher
+from locks import event_lock
+from supabase_function import delete_files
+from thumbnails import stored_crop_path
+
+
+def recluster_event(db, event_id, folder_path, threshold=DISTANCE_THRESHOLD):
+    # Merge-only: whole faces are clustered by their stored embedding, a
+    # sighting matched to the wrong face during ingestion is not moved
+    faces = db.faces
+    reembed_event_faces(db, event_id, folder_path)
+    # Ingestion for the event waits while the faces are rewritten
+    with event_lock(db, event_id) as held:
+        start = time.perf_counter()
+        ids, matrix, _ = load_event_embeddings(db, event_id)
+        if not ids:
+            return {"faces": 0, "clusters": 0, "merged": 0}
+
+        sources, targets, weights = similarity_edges(matrix, threshold)
+        labels = chinese_whispers(len(ids), sources, targets, weights)
+        cluster_time = time.perf_counter() - start
+
+        face_docs = {
+            face["id"]: face
+            for face in faces.find(
+                {"event_id": event_id}, {"id": 1, "name": 1, "crop_path": 1}
+            )
+        }
+        photo_counts = {
+            row["_id"]: row["count"]
+            for row in db.occurrences.aggregate(
+                [
+                    {"$match": {"event_id": event_id}},
+                    {"$group": {"_id": "$face_id", "count": {"$sum": 1}}},
+                ]
+            )
+        }
+
+        clusters = {}
+        for face_id, label in zip(ids, labels):
+            if face_id in face_docs:
+                clusters.setdefault(label, []).append(face_docs[face_id])
+
+        operations = []
+        merged_ids = []
+        merged_crops = []
+        for members in clusters.values():
+            if len(members) < 2:
+                continue
+            # Keep a named face if there is one, then the one with most photos
+            members.sort(
+                key=lambda face: (
+                    face["name"] != "unknown",
+                    photo_counts.get(face["id"], 0),
+                ),
+                reverse=True,
+            )
+            keeper, others = members[0], members[1:]
+            # The merged faces' sightings move to the kept face
+            operations.append(
+                UpdateMany(
+                    {"face_id": {"$in": [face["id"] for face in others]}},
+                    {"$set": {"face_id": keeper["id"]}},
+                )
+            )
+            merged_ids.extend(face["id"] for face in others)
+            merged_crops.extend(stored_crop_path(folder_path, face) for face in others)
+
+        if operations:
+            if not held():
+                raise RuntimeError(f"Lost the lock on event {event_id}")
+            db.occurrences.bulk_write(operations, ordered=False)
+            faces.delete_many({"id": {"$in": merged_ids}})
+            delete_files(merged_crops)
+
+        reset_matcher(event_id)
+
+    return {
+        "faces": len(ids),
+        "clusters": len(clusters),
+        "merged": len(merged_ids),
+        "edges": len(sources),
+        "cluster_seconds": round(cluster_time, 3),
+        "total_seconds": round(time.perf_counter() - start, 3),
+    }
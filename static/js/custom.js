@@ -43,6 +43,55 @@ document.addEventListener("alpine:init", () => {
   }));
 });
 
+// Loads the next page from url whenever the sentinel scrolls into view.
+// The endpoint returns {items, next_cursor}; renderItem turns an item into an
+// element appended to container.
+function infiniteScroll(sentinel, container, url, renderItem) {
+  if (!sentinel || !sentinel.dataset.nextCursor) return;
+  var loading = false;
+
+  var observer = new IntersectionObserver(
+    (entries) => {
+      if (loading || !entries.some((entry) => entry.isIntersecting)) return;
+      loading = true;
+
+      var pageUrl = `${url}?cursor=${encodeURIComponent(sentinel.dataset.nextCursor)}`;
+      fetch(pageUrl, { credentials: "same-origin" })
+        .then((response) => response.json())
+        .then(({ items, next_cursor }) => {
+          items.forEach((item) => container.appendChild(renderItem(item)));
+          if (next_cursor) {
+            sentinel.dataset.nextCursor = next_cursor;
+            // Observe again in case the sentinel is still visible
+            observer.unobserve(sentinel);
+            observer.observe(sentinel);
+          } else {
+            delete sentinel.dataset.nextCursor;
+            observer.disconnect();
+          }
+        })
+        .catch((error) => console.log(error))
+        .finally(() => {
+          loading = false;
+        });
+    },
+    { rootMargin: "600px" }
+  );
+  observer.observe(sentinel);
+}
+
+function createElement(html) {
+  var template = document.createElement("template");
+  template.innerHTML = html.trim();
+  return template.content.firstChild;
+}
+
+function escapeHtml(value) {
+  var div = document.createElement("div");
+  div.textContent = value;
+  return div.innerHTML.replace(/"/g, "&quot;");
+}
+
 document.addEventListener("DOMContentLoaded", () => {
   console.log("Ready!");
 
@@ -64,7 +113,8 @@ document.addEventListener("DOMContentLoaded", () => {
   //   }
   // });
 
-  $(".nameInput").on("focusout", function () {
+  // Delegated so inputs appended by infinite scroll are handled too
+  $(document).on("focusout", ".nameInput", function () {
     var newName = $(this).val();
     var faceId = $(this).data("face-id"); // Retrieve the face ID from the data attribute
     var csrfToken = $(this).data("csrf-token"); // Retrieve the face ID from the data attribute
@@ -0,0 +1,153 @@
+from contextlib import contextmanager
+import hashlib
+import time
+import os
+
+from local_db import connect_sqlite
+
+# On-disk LRU cache of storage objects. Contents are stored once per sha256
+# under blobs/, and refs maps each object path to its blob. Shared by all
+# processes using the same folder. Entries are keyed by path only and dropped
+# when the path is written or removed through StorageClient; stored paths are
+# never rewritten with other content (faces and photos get new ids), so no
+# etag lookup is needed before a read.
+CACHE_FOLDER = os.getenv("STORAGE_CACHE_FOLDER", "storage_cache")
+CACHE_MAX_BYTES = int(os.getenv("STORAGE_CACHE_MAX_BYTES", str(1024**3)))
+
+
+@contextmanager
+def connect():
+    os.makedirs(CACHE_FOLDER, exist_ok=True)
+    with connect_sqlite(os.path.join(CACHE_FOLDER, "index.db")) as conn:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS refs (path TEXT PRIMARY KEY,"
+            " digest TEXT NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS refs_accessed ON refs (accessed)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)"
+        )
+        yield conn
+
+
+def _blob_path(digest):
+    return os.path.join(CACHE_FOLDER, "blobs", digest[:2], digest)
+
+
+def _count(conn, name, amount=1):
+    conn.execute(
+        "INSERT INTO stats (name, value) VALUES (?, ?)"
+        " ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+        (name, amount),
+    )
+
+
+def get(path):
+    # Cached bytes of path, or None on a miss
+    with connect() as conn:
+        ref = conn.execute("SELECT * FROM refs WHERE path = ?", (path,)).fetchone()
+        if ref:
+            try:
+                with open(_blob_path(ref["digest"]), "rb") as f:
+                    data = f.read()
+                conn.execute(
+                    "UPDATE refs SET accessed = ? WHERE path = ?", (time.time(), path)
+                )
+                _count(conn, "hits")
+                return data
+            except FileNotFoundError:
+                pass
+        _count(conn, "misses")
+    return None
+
+
+def put(path, data):
+    digest = hashlib.sha256(data).hexdigest()
+    blob_path = _blob_path(digest)
+    if not os.path.exists(blob_path):
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        tmp_path = f"{blob_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, blob_path)
+
+    with connect() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO refs (path, digest, size, accessed)"
+            " VALUES (?, ?, ?, ?)",
+            (path, digest, len(data), time.time()),
+        )
+        _evict(conn)
+
+
+def _drop(conn, refs):
+    # Remove refs and any blob no other path still points to, return bytes freed
+    freed = 0
+    for ref in refs:
+        conn.execute("DELETE FROM refs WHERE path = ?", (ref["path"],))
+        shared = conn.execute(
+            "SELECT 1 FROM refs WHERE digest = ? LIMIT 1", (ref["digest"],)
+        ).fetchone()
+        if not shared:
+            try:
+                os.remove(_blob_path(ref["digest"]))
+            except FileNotFoundError:
+                pass
+            freed += ref["size"]
+    return freed
+
+
+def invalidate(paths):
+    with connect() as conn:
+        refs = [
+            ref
+            for path in paths
+            for ref in conn.execute(
+                "SELECT path, digest, size FROM refs WHERE path = ?", (path,)
+            ).fetchall()
+        ]
+        _drop(conn, refs)
+
+
+def invalidate_prefix(prefix):
+    with connect() as conn:
+        refs = conn.execute(
+            "SELECT path, digest, size FROM refs WHERE substr(path, 1, ?) = ?",
+            (len(prefix), prefix),
+        ).fetchall()
+        _drop(conn, refs)
+
+
+def _evict(conn, max_bytes=CACHE_MAX_BYTES):
+    # Blob bytes count once however many paths share them
+    total = conn.execute(
+        "SELECT COALESCE(SUM(size), 0) FROM"
+        " (SELECT digest, MAX(size) AS size FROM refs GROUP BY digest)"
+    ).fetchone()[0]
+    if total <= max_bytes:
+        return
+
+    for ref in conn.execute("SELECT path, digest, size FROM refs ORDER BY accessed").fetchall():
+        total -= _drop(conn, [ref])
+        _count(conn, "evictions")
+        if total <= max_bytes:
+            break
+
+
+def stats():
+    with connect() as conn:
+        counters = {
+            row["name"]: row["value"]
+            for row in conn.execute("SELECT name, value FROM stats")
+        }
+        entries, size = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM refs"
+        ).fetchone()
+    return {
+        "hits": counters.get("hits", 0),
+        "misses": counters.get("misses", 0),
+        "evictions": counters.get("evictions", 0),
+        "entries": entries,
+        "bytes": size,
+        "max_bytes": CACHE_MAX_BYTES,
+    }
@@ -0,0 +1,146 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+import storage_cache
+import upload_queue
+from storage_urls import UrlBuilder
+
+# Parallel storage requests per process
+STORAGE_WORKERS = int(os.getenv("STORAGE_WORKERS", "16"))
+LIST_PAGE_SIZE = 1000
+REMOVE_BATCH_SIZE = 1000
+
+
+# Storage layer over one Supabase bucket. The bucket proxy and its HTTP
+# connection pool are shared by every call, and bulk operations fan out over a
+# bounded thread pool.
+class StorageClient:
+    def __init__(self, client, bucket_name, supabase_url, workers=STORAGE_WORKERS):
+        self.bucket_name = bucket_name
+        self.bucket = client.storage.from_(bucket_name)
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="storage")
+        self.url_builder = UrlBuilder(supabase_url, bucket_name, self.bucket)
+        upload_queue.init_uploads()
+
+    # Downloads
+
+    def download(self, path, cache=True):
+        # Served from the local cache when possible. Files still waiting in the
+        # write-behind queue are read from the spool. cache=False is for files
+        # read once, such as exports, so they don't evict the ones read often.
+        data = storage_cache.get(path) if cache else None
+        if data is None:
+            data = upload_queue.pending_data(path)
+        if data is None:
+            data = self.bucket.download(path)
+            if cache:
+                storage_cache.put(path, data)
+        return data
+
+    def download_async(self, path, cache=True):
+        return self.executor.submit(self.download, path, cache)
+
+    def download_many(self, paths, cache=True):
+        return list(self.executor.map(lambda path: self.download(path, cache=cache), paths))
+
+    # Uploads
+
+    def upload(self, path, data, content_type, upsert=False):
+        storage_cache.invalidate([path])
+        file_options = {"content-type": content_type}
+        if upsert:
+            file_options["upsert"] = "true"
+        self.bucket.upload(file=data, path=path, file_options=file_options)
+
+    def upload_async(self, path, data, content_type, upsert=False):
+        return self.executor.submit(self.upload, path, data, content_type, upsert)
+
+    def upload_many(self, items):
+        # items are (path, data, content_type) tuples
+        futures = [self.upload_async(*item) for item in items]
+        for future in futures:
+            future.result()
+
+    # Write-behind uploads, spooled locally and sent in the background
+
+    def start_uploader(self):
+        upload_queue.ensure_uploader(self)
+
+    def upload_later(self, items):
+        # items are (path, data, content_type) tuples
+        upload_queue.ensure_uploader(self)
+        upload_queue.enqueue_uploads(items)
+
+    def upload_file_later(self, path, local_path, content_type):
+        # Moves local_path into the spool
+        upload_queue.ensure_uploader(self)
+        upload_queue.enqueue_upload_file(path, local_path, content_type)
+
+    def flush(self, timeout=None):
+        # Wait until every upload queued so far is in storage
+        upload_queue.ensure_uploader(self)
+        return upload_queue.flush(timeout)
+
+    # Listing
+
+    def list(self, folder_path):
+        # Every entry of the folder, following pagination
+        entries = []
+        offset = 0
+        while True:
+            page = self.bucket.list(
+                folder_path,
+                {
+                    "limit": LIST_PAGE_SIZE,
+                    "offset": offset,
+                    "sortBy": {"column": "name", "order": "asc"},
+                },
+            )
+            entries.extend(page)
+            if len(page) < LIST_PAGE_SIZE:
+                return entries
+            offset += LIST_PAGE_SIZE
+
+    def list_files(self, folder_path):
+        # Paths of all files under folder_path, subfolders are listed in parallel
+        files = []
+        folders = [folder_path]
+        while folders:
+            listings = self.executor.map(self.list, folders)
+            next_folders = []
+            for folder, entries in zip(folders, listings):
+                for entry in entries:
+                    full_path = f"{folder}/{entry['name']}"
+                    if entry["id"] is None:
+                        next_folders.append(full_path)
+                    else:
+                        files.append(full_path)
+            folders = next_folders
+        return files
+
+    # Deletes
+
+    def remove(self, paths):
+        # Many paths per request, batches sent in parallel
+        paths = list(paths)
+        batches = [
+            paths[i : i + REMOVE_BATCH_SIZE]
+            for i in range(0, len(paths), REMOVE_BATCH_SIZE)
+        ]
+        upload_queue.cancel_uploads(paths)
+        list(self.executor.map(self.bucket.remove, batches))
+        storage_cache.invalidate(paths)
+
+    def remove_folder(self, folder_path):
+        upload_queue.cancel_uploads(prefix=f"{folder_path}/")
+        self.remove(self.list_files(folder_path))
+        storage_cache.invalidate_prefix(f"{folder_path}/")
+
+    # URLs
+
+    def url(self, path):
+        return self.url_builder.url(path)
+
+    def urls(self, paths):
+        # Public URLs built locally, or signed URLs when SUPABASE_SIGNED_URLS is set
+        return self.url_builder.urls(paths)
@@ -0,0 +1,72 @@
+from urllib.parse import quote
+import threading
+import time
+import os
+
+# Serve signed URLs instead of public ones, for private buckets
+SIGNED_URLS = os.getenv("SUPABASE_SIGNED_URLS", "0") == "1"
+SIGNED_URL_TTL = int(os.getenv("SUPABASE_SIGNED_URL_TTL", "3600"))
+MAX_SIGNED_CACHE = 100000
+
+
+# Builds object URLs locally from the bucket config. Public URLs need no
+# request at all; signed URLs are created in one batch call for all paths
+# not already cached and reused until close to their expiry.
+class UrlBuilder:
+    def __init__(
+        self,
+        supabase_url,
+        bucket_name,
+        bucket=None,
+        signed=SIGNED_URLS,
+        ttl=SIGNED_URL_TTL,
+    ):
+        self.public_base = (
+            f"{supabase_url.rstrip('/')}/storage/v1/object/public/{bucket_name}/"
+        )
+        self.bucket = bucket
+        self.signed = signed
+        self.ttl = ttl
+        self._signed_cache = {}
+        self._lock = threading.Lock()
+
+    def public_urls(self, paths):
+        base = self.public_base
+        return [base + quote(path) for path in paths]
+
+    def signed_urls(self, paths):
+        now = time.time()
+        with self._lock:
+            cached = {
+                path: entry[0]
+                for path in paths
+                if (entry := self._signed_cache.get(path)) and entry[1] > now
+            }
+        missing = list(dict.fromkeys(path for path in paths if path not in cached))
+
+        if missing:
+            # Refresh once 80% of the lifetime has passed so pages never get
+            # a URL that expires while being viewed
+            expires_at = now + 0.8 * self.ttl
+            created = self.bucket.create_signed_urls(missing, self.ttl)
+            with self._lock:
+                if len(self._signed_cache) > MAX_SIGNED_CACHE:
+                    self._signed_cache = {
+                        path: entry
+                        for path, entry in self._signed_cache.items()
+                        if entry[1] > now
+                    }
+                for item in created:
+                    url = item.get("signedURL") or item.get("signedUrl")
+                    if url:
+                        cached[item["path"]] = url
+                        self._signed_cache[item["path"]] = (url, expires_at)
+
+        return [cached.get(path) for path in paths]
+
+    def urls(self, paths):
+        paths = list(paths)
+        return self.signed_urls(paths) if self.signed else self.public_urls(paths)
+
+    def url(self, path):
+        return self.urls([path])[0]
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from clustering import chinese_whispers, similarity_edges
+
+
+def separated_clusters(num_clusters, size, seed=0):
+    # Unit embeddings tightly spread around random, far apart centres
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(num_clusters, 128))
+    matrix = np.repeat(centres, size, axis=0) + 0.05 * rng.normal(size=(num_clusters * size, 128))
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix.astype(np.float32), np.repeat(np.arange(num_clusters), size)
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_chinese_whispers_finds_every_cluster(seed):
+    matrix, truth = separated_clusters(500, 10)
+    labels = chinese_whispers(len(matrix), *similarity_edges(matrix, 0.4), seed=seed)
+
+    assert len(set(labels)) == 500
+    # Each true cluster ends up with a single label
+    for cluster in range(500):
+        assert len(set(labels[truth == cluster])) == 1
+
+
+def test_chinese_whispers_without_edges():
+    matrix, _ = separated_clusters(3, 1)
+    sources, targets, weights = similarity_edges(matrix, 0.01)
+
+    assert len(sources) == 0
+    assert list(chinese_whispers(3, sources, targets, weights)) == [0, 1, 2]
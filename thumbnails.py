@@ -0,0 +1,91 @@
+from io import BytesIO
+from PIL import Image
+import numpy as np
+import cv2
+import os
+
+# Galleries show thumbnails and face crops instead of the originals, which are
+# only loaded when a photo is opened
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "480"))
+FACE_CROP_SIZE = int(os.getenv("FACE_CROP_SIZE", "160"))
+# webp or jpeg
+THUMBNAIL_FORMAT = os.getenv("THUMBNAIL_FORMAT", "webp")
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+
+ENCODE_FLAGS = {
+    "webp": cv2.IMWRITE_WEBP_QUALITY,
+    "jpeg": cv2.IMWRITE_JPEG_QUALITY,
+}
+CONTENT_TYPE = f"image/{THUMBNAIL_FORMAT}"
+EXTENSION = "jpg" if THUMBNAIL_FORMAT == "jpeg" else THUMBNAIL_FORMAT
+
+# JPEGs can be decoded directly at 1/2, 1/4 or 1/8 size, which skips most of
+# the decoding work
+REDUCED_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+}
+
+
+def decode_image(img_bytes, min_side=None):
+    # Decode to BGR. With min_side, decode at the smallest reduced size whose
+    # longest side is still at least min_side.
+    flag = cv2.IMREAD_COLOR
+    if min_side:
+        try:
+            longest = max(Image.open(BytesIO(img_bytes)).size)
+            for factor, reduced_flag in REDUCED_FLAGS.items():
+                if longest // factor >= min_side:
+                    flag = reduced_flag
+                    break
+        except Exception as e:
+            print(f"Error reading image size: {e}")
+    return cv2.imdecode(np.frombuffer(img_bytes, np.uint8), flag)
+
+
+def resize_to_fit(img, size):
+    # Shrink so the longest side is at most size, never enlarge
+    h, w = img.shape[:2]
+    factor = size / max(h, w)
+    if factor >= 1:
+        return img
+    return cv2.resize(
+        img,
+        (max(1, round(w * factor)), max(1, round(h * factor))),
+        interpolation=cv2.INTER_AREA,
+    )
+
+
+def encode_compact(img):
+    is_success, buffer = cv2.imencode(
+        f".{EXTENSION}", img, [ENCODE_FLAGS[THUMBNAIL_FORMAT], THUMBNAIL_QUALITY]
+    )
+    return buffer.tobytes() if is_success else None
+
+
+def make_thumbnail(img):
+    return encode_compact(resize_to_fit(img, THUMBNAIL_SIZE))
+
+
+def thumbnail_from_bytes(img_bytes):
+    img = decode_image(img_bytes, min_side=THUMBNAIL_SIZE)
+    return make_thumbnail(img) if img is not None else None
+
+
+def make_face_crop(img):
+    return encode_compact(resize_to_fit(img, FACE_CROP_SIZE))
+
+
+def thumbnail_path(event_path, img_id):
+    # Stored next to the originals, in the event's thumbs folder
+    return f"{event_path}/thumbs/{img_id}.{EXTENSION}"
+
+
+def face_crop_path(folder_path, face_id):
+    return f"{folder_path}/{face_id}.{EXTENSION}"
+
+
+def stored_crop_path(folder_path, face):
+    # Faces created before crops were compacted have a png crop and no crop_path
+    return face.get("crop_path") or f"{folder_path}/{face['id']}.png"
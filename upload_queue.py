@@ -0,0 +1,274 @@
+import shutil
+import threading
+import time
+import uuid
+import os
+
+from local_db import connect_sqlite
+
+# Write-behind queue for storage uploads. Files are spooled to local disk and
+# recorded here before the caller moves on; uploader threads send them to
+# storage in the background, retrying failures with backoff. Pending uploads
+# survive a crash and are picked up again by the next process that starts an
+# uploader.
+UPLOAD_QUEUE_DB = os.getenv("UPLOAD_QUEUE_DB", "upload_queue.db")
+UPLOAD_SPOOL_FOLDER = os.getenv("UPLOAD_SPOOL_FOLDER", "upload_spool")
+UPLOAD_BATCH_SIZE = int(os.getenv("UPLOAD_BATCH_SIZE", "32"))
+MAX_ATTEMPTS = int(os.getenv("UPLOAD_MAX_ATTEMPTS", "8"))
+MAX_BACKOFF = 300
+# Running uploads not updated for this many seconds are assumed lost
+UPLOAD_TIMEOUT = int(os.getenv("UPLOAD_TIMEOUT", "300"))
+POLL_INTERVAL = 0.5
+
+
+def connect():
+    return connect_sqlite(UPLOAD_QUEUE_DB)
+
+
+def init_uploads():
+    with connect() as conn:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS uploads (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                path TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                content_type TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                next_attempt REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS uploads_status ON uploads (status, next_attempt)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS uploads_path ON uploads (path)")
+
+
+def _spool_path():
+    os.makedirs(UPLOAD_SPOOL_FOLDER, exist_ok=True)
+    return os.path.join(UPLOAD_SPOOL_FOLDER, uuid.uuid4().hex)
+
+
+def _record(files):
+    # files are (path, spooled file, content_type) tuples
+    now = time.time()
+    with connect() as conn:
+        conn.executemany(
+            "INSERT INTO uploads (path, file_path, content_type, next_attempt, updated_at)"
+            " VALUES (?, ?, ?, ?, ?)",
+            [(path, file_path, content_type, now, now) for path, file_path, content_type in files],
+        )
+    _wake.set()
+
+
+def enqueue_uploads(items):
+    # items are (path, data, content_type) tuples, written to the spool
+    # before they are queued
+    files = []
+    for path, data, content_type in items:
+        file_path = _spool_path()
+        with open(file_path, "wb") as f:
+            f.write(data)
+        files.append((path, file_path, content_type))
+    if files:
+        _record(files)
+
+
+def enqueue_upload_file(path, local_path, content_type):
+    # Move a file already on local disk into the spool instead of copying it
+    file_path = _spool_path()
+    shutil.move(local_path, file_path)
+    _record([(path, file_path, content_type)])
+
+
+def pending_data(path):
+    # Bytes of the newest upload still waiting for path, so reads right after
+    # a write see it
+    with connect() as conn:
+        row = conn.execute(
+            "SELECT file_path FROM uploads WHERE path = ?"
+            " ORDER BY id DESC LIMIT 1",
+            (path,),
+        ).fetchone()
+    if row:
+        try:
+            with open(row["file_path"], "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+    return None
+
+
+def cancel_uploads(paths=(), prefix=None):
+    # Drop pending uploads of deleted files so they are not written back
+    with connect() as conn:
+        rows = [
+            row
+            for path in paths
+            for row in conn.execute(
+                "SELECT id, file_path FROM uploads WHERE path = ?",
+                (path,),
+            ).fetchall()
+        ]
+        if prefix:
+            rows += conn.execute(
+                "SELECT id, file_path FROM uploads"
+                " WHERE substr(path, 1, ?) = ?",
+                (len(prefix), prefix),
+            ).fetchall()
+        conn.executemany("DELETE FROM uploads WHERE id = ?", [(row["id"],) for row in rows])
+    for row in rows:
+        _remove_spooled(row["file_path"])
+
+
+def _remove_spooled(file_path):
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+
+
+def claim_uploads(limit=UPLOAD_BATCH_SIZE):
+    # Atomically move due uploads to running, across processes
+    now = time.time()
+    with connect() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE uploads SET status = 'pending', updated_at = ?"
+                " WHERE status = 'running' AND updated_at < ?",
+                (now, now - UPLOAD_TIMEOUT),
+            )
+            rows = conn.execute(
+                "SELECT * FROM uploads WHERE status = 'pending' AND next_attempt <= ?"
+                " ORDER BY id LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE uploads SET status = 'running', updated_at = ? WHERE id = ?",
+                [(now, row["id"]) for row in rows],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    return [dict(row) for row in rows]
+
+
+def finish_upload(upload):
+    with connect() as conn:
+        conn.execute("DELETE FROM uploads WHERE id = ?", (upload["id"],))
+    _remove_spooled(upload["file_path"])
+
+
+def retry_upload(upload, error):
+    # Back off exponentially, give up after MAX_ATTEMPTS but keep the file
+    attempts = upload["attempts"] + 1
+    status = "failed" if attempts >= MAX_ATTEMPTS else "pending"
+    now = time.time()
+    with connect() as conn:
+        conn.execute(
+            "UPDATE uploads SET status = ?, attempts = ?, error = ?, next_attempt = ?,"
+            " updated_at = ? WHERE id = ?",
+            (status, attempts, str(error), now + min(2**attempts, MAX_BACKOFF), now, upload["id"]),
+        )
+
+
+def requeue_failed():
+    with connect() as conn:
+        return conn.execute(
+            "UPDATE uploads SET status = 'pending', attempts = 0, next_attempt = ?"
+            " WHERE status = 'failed'",
+            (time.time(),),
+        ).rowcount
+
+
+def upload_stats():
+    with connect() as conn:
+        rows = conn.execute(
+            "SELECT status, COUNT(*) AS count FROM uploads GROUP BY status"
+        ).fetchall()
+    counts = {"pending": 0, "running": 0, "failed": 0}
+    for row in rows:
+        counts[row["status"]] = row["count"]
+    return counts
+
+
+def flush(timeout=None):
+    # Barrier: wait until every upload queued before the call is in storage.
+    # Returns False on timeout or when some of them failed for good.
+    with connect() as conn:
+        watermark = conn.execute("SELECT COALESCE(MAX(id), 0) FROM uploads").fetchone()[0]
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+        with connect() as conn:
+            rows = conn.execute(
+                "SELECT status, COUNT(*) AS count FROM uploads WHERE id <= ? GROUP BY status",
+                (watermark,),
+            ).fetchall()
+        counts = {row["status"]: row["count"] for row in rows}
+        if not counts.get("pending") and not counts.get("running"):
+            return not counts.get("failed")
+        if deadline is not None and time.time() >= deadline:
+            return False
+        _wake.set()
+        time.sleep(0.1)
+
+
+def run_uploader(storage):
+    # Send claimed uploads through the storage client's thread pool
+    while True:
+        uploads = claim_uploads()
+        if not uploads:
+            _wake.wait(POLL_INTERVAL)
+            _wake.clear()
+            continue
+
+        futures = []
+        for upload in uploads:
+            try:
+                with open(upload["file_path"], "rb") as f:
+                    data = f.read()
+            except FileNotFoundError as e:
+                # Spool file is gone, nothing left to upload
+                print(f"Error reading spooled upload {upload['path']}: {e}")
+                finish_upload(upload)
+                continue
+            futures.append(
+                (
+                    upload,
+                    storage.upload_async(
+                        upload["path"], data, upload["content_type"], upsert=True
+                    ),
+                )
+            )
+
+        for upload, future in futures:
+            try:
+                future.result()
+                finish_upload(upload)
+            except Exception as e:
+                print(f"Error uploading {upload['path']}: {e}")
+                retry_upload(upload, e)
+
+
+_wake = threading.Event()
+_uploader_thread = None
+_uploader_lock = threading.Lock()
+
+
+def ensure_uploader(storage):
+    # Start this process's uploader thread on first use
+    global _uploader_thread
+    with _uploader_lock:
+        if _uploader_thread and _uploader_thread.is_alive():
+            return
+        init_uploads()
+        _uploader_thread = threading.Thread(
+            target=run_uploader, args=(storage,), daemon=True
+        )
+        _uploader_thread.start()
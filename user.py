@@ -3,16 +3,13 @@ import uuid
 
 # User class
 class User:
-    def __init__(
-        self, first_name, last_name, email, id="", profile_image="", events=[]
-    ):
+    def __init__(self, first_name, last_name, email, id="", profile_image=""):
         # Main initialiser
         self.id = uuid.uuid4().hex if not id else id
         self.first_name = first_name
         self.last_name = last_name
         self.email = email
         self.profile_image = profile_image
-        self.events = events
 
     @classmethod
     def make_from_dict(cls, d):
@@ -33,7 +30,6 @@ class User:
             "last_name": self.last_name,
             "email": self.email,
             "profile_image": self.profile_image,
-            "events": self.events,
         }
 
     def display_name(self):
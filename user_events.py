@@ -0,0 +1,69 @@
+from collections import OrderedDict
+import threading
+
+# Events and preview faces shown in the sidebar and dashboard, cached per user.
+# The user document carries events_version, bumped whenever one of the user's
+# events is added, deleted or gains faces, or a face is renamed, so every
+# process sees the change on its next render at the cost of one lookup by id.
+CACHE_SIZE = 1024
+PREVIEW_FACES = 4
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def invalidate_user_events(db, user_id):
+    db.users.update_one({"id": user_id}, {"$inc": {"events_version": 1}})
+
+
+def load_user_events(db, user_id):
+    # Event fields, plus the face count and the first few faces of each event
+    events = list(
+        db.events.find(
+            {"user_id": user_id},
+            {"id": 1, "title": 1, "location": 1, "start": 1, "end": 1, "desc": 1},
+        ).sort("_id", 1)
+    )
+    previews = {
+        row["_id"]: row
+        for row in db.faces.aggregate(
+            [
+                {"$match": {"event_id": {"$in": [event["id"] for event in events]}}},
+                {"$project": {"_id": 0, "id": 1, "name": 1, "event_id": 1, "crop_path": 1}},
+                {
+                    "$group": {
+                        "_id": "$event_id",
+                        "faces": {"$push": "$$ROOT"},
+                        "face_count": {"$sum": 1},
+                    }
+                },
+                {"$project": {"faces": {"$slice": ["$faces", PREVIEW_FACES]}, "face_count": 1}},
+            ]
+        )
+    }
+    for event in events:
+        preview = previews.get(event["id"], {})
+        event["faces"] = preview.get("faces", [])
+        event["face_count"] = preview.get("face_count", 0)
+    return events
+
+
+def get_user_events(db, user_id):
+    user = db.users.find_one({"id": user_id}, {"events_version": 1})
+    if not user:
+        return []
+    version = user.get("events_version", 0)
+
+    with _lock:
+        cached = _cache.get(user_id)
+        if cached and cached[0] == version:
+            _cache.move_to_end(user_id)
+            return cached[1]
+
+    events = load_user_events(db, user_id)
+    with _lock:
+        _cache[user_id] = (version, events)
+        _cache.move_to_end(user_id)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return events
@@ -1,6 +1,25 @@
+from bson import ObjectId
+from collections import deque
+import io
 import os
+import time
 import zipfile
-from supabase_function import download_file
+from supabase_function import storage
+
+# Documents per page of paginated queries
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "60"))
+# Photos downloaded ahead while streaming a ZIP
+ZIP_DOWNLOAD_WINDOW = int(os.getenv("ZIP_DOWNLOAD_WINDOW", "16"))
+
+
+def paginate(collection, query, cursor=None, limit=PAGE_SIZE, projection=None):
+    # Keyset pagination on _id, cursor is the last _id of the previous page.
+    # Returns the page and the cursor of the next one, None on the last page.
+    if cursor:
+        query = {**query, "_id": {"$gt": ObjectId(cursor)}}
+    docs = list(collection.find(query, projection).sort("_id", 1).limit(limit + 1))
+    next_cursor = str(docs[limit - 1]["_id"]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
 
 
 def delete_folder(folder_path):
@@ -19,18 +38,6 @@ def delete_folder(folder_path):
         print(f"Error deleting folder '{folder_path}': {e}")
 
 
-def remove_files_from_folder(folder_path):
-    files = os.listdir(folder_path)
-
-    for file in files:
-        file_path = os.path.join(folder_path, file)
-        try:
-            if os.path.isfile(file_path):
-                os.remove(file_path)
-        except Exception as e:
-            print(f"Error removing {file_path}: {e}")
-
-
 def delete_file(file_path):
     try:
         if os.path.isfile(file_path):
@@ -39,15 +46,65 @@ def delete_file(file_path):
         print(f"Error removing {file_path}: {ex}")
 
 
-def create_zip(file_list, zip_file):
-    with zipfile.ZipFile(zip_file, "w") as zipf:
-        for file in file_list:
-            zipf.write(file, os.path.basename(file))
+# Write-only, unseekable buffer that ZipFile streams into
+class _ZipStream(io.RawIOBase):
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(file_list, window=ZIP_DOWNLOAD_WINDOW):
+    # Yield a ZIP of the storage files chunk by chunk. Downloads run ahead on
+    # the storage thread pool in a bounded window, so memory holds at most
+    # window files at a time.
+    stream = _ZipStream()
+    files = iter(file_list)
+    pending = deque()
+
+    def submit_next():
+        file = next(files, None)
+        if file is not None:
+            # Originals go straight from the bucket, past the local cache
+            pending.append((file, storage.download_async(file, cache=False)))
+
+    try:
+        for _ in range(window):
+            submit_next()
+
+        with zipfile.ZipFile(stream, "w") as zipf:
+            while pending:
+                file, future = pending.popleft()
+                submit_next()
+                try:
+                    data = future.result()
+                except Exception as e:
+                    print(f"Error downloading {file}: {e}")
+                    continue
 
+                # JPEGs are already compressed, store them as is
+                info = zipfile.ZipInfo(os.path.basename(file), time.localtime()[:6])
+                info.compress_type = (
+                    zipfile.ZIP_STORED
+                    if file.lower().endswith((".jpg", ".jpeg"))
+                    else zipfile.ZIP_DEFLATED
+                )
+                zipf.writestr(info, data)
+                yield stream.take()
 
-def download_create_zip(download_folder, file_list, zip_file):
-    with zipfile.ZipFile(zip_file, "w") as zipf:
-        for file in file_list:
-            temp_file = os.path.join(download_folder, file.split("/")[-1])
-            if download_file(temp_file, file):
-                zipf.write(temp_file, os.path.basename(temp_file))
+        # Central directory, written when the archive is closed
+        yield stream.take()
+    finally:
+        # Client went away, drop downloads that haven't started
+        for _, future in pending:
+            future.cancel()